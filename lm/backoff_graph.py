@@ -0,0 +1,510 @@
+# -*- coding: utf-8 -*-
+"""
+Generalized (parallel) backoff graphs for multidimensional backoff LMs
+
+Instead of the fixed ww -> sw -> lw -> unigram chain of create-lm_2g3c.py, a
+backoff graph declares the bigram tables (nodes) and which tables each one
+backs off to (edges). A node can back off to several nodes at once; their
+scores are then combined (max, mean or product), as in generalized parallel
+backoff for factored LMs. Scores of nodes reached by more than one path are
+memoized per query, so scoring stays linear in the size of the graph.
+
+Graph file format (one declaration per line, # for comments):
+    node name label    bigram table P(word | previous token's factor 'label')
+    node name          unigram table (no context); every path must end here
+    edge from to       'from' backs off to 'to'
+    combine name how   how to combine several backoff nodes (max, mean, product)
+    - the first node declared is where scoring starts
+    - e.g. create-lm_2g3c.py is: node ww W, node sw S, node lw L, node uni,
+      edge ww sw, edge sw lw, edge lw uni (see 2g3c.graph)
+
+Backoff weights are stored per node and per backoff signature: the node's
+context followed by the contexts of the nodes it backs off to. If the node's
+context determines the others (e.g. small clusters are subsets of large ones)
+this is one weight per context; otherwise (non-nested clusters) each observed
+combination gets its own weight. With max or product, the combined scores don't
+sum to one, so the weights are normalized over the whole vocabulary.
+
+Model file format: like create-lm_2g3c.py, but with a \\graph: section first,
+one \\2-grams name: section per bigram node and one \\backoff name: section
+(weight<TAB>signature) per node with backoff nodes.
+
+Created on Tue Oct 20 09:37:15 2026
+"""
+
+## TO DO ##
+#  1. allow contexts made of several factors (e.g. node sl S,L)
+#  2. top-k prediction for graphs (combined scores can't be merged lazily)
+#  3. count cutoffs per node
+
+from __future__ import division
+from collections import OrderedDict
+from math import log
+import sys, model, utils
+
+# word label (the predicted factor is always the word)
+WORD_LABEL = model.WORD_LABEL
+
+# section holding the graph in model files
+GRAPH_SECTION = 'graph'
+# prefix of the backoff sections in model files
+BACKOFF_PREFIX = 'backoff '
+
+# ways of combining the scores of several backoff nodes
+COMBINE_METHODS = ['max', 'mean', 'product']
+DEFAULT_COMBINE = 'max'
+# methods whose combined scores sum to one over the vocabulary, like a single
+# backoff node's (see calc_backoff_graph)
+NORMALIZED_COMBINE = ['mean']
+
+
+## multidimensional backoff LM with a backoff graph
+# input: graph (from read_graph), unk log prob, unigram log probs,
+#        backoff weights {node:{signature:log backoff}}
+# note subclasses hold the bigram rows: they implement bigrams(node, context);
+#      there is no top_k (see TO DO 2)
+class GraphBackoffModel(model.LanguageModel):
+    def __init__(self, graph, prob_unk, prob_unigrams, backoffs):
+        model.LanguageModel.__init__(self, prob_unk, prob_unigrams)
+        self.graph = graph
+        self.backoffs = backoffs
+
+
+    ## gets the log prob of a bigram (or of a unigram if no previous token)
+    # input: previous token and current token (W-word|S-small|L-large)
+    # output: log prob of token given prev token, following the backoff graph
+    def logprob(self, prev_token, token):
+        word2 = utils.get_part(token, WORD_LABEL)
+        # start of sentence: unigram only
+        if not prev_token:
+            return self.logprob_uni(word2)
+        contexts = get_contexts(prev_token, self.graph)
+        return self.node_score(self.graph['root'], contexts, word2, {})
+
+
+    ## gets the score of a node, following its backoff edges if needed
+    # input: node name, contexts of the previous token {label:factor},
+    #        current word, memo of node scores for this query {node:score}
+    # output: log prob of the word at this node
+    def node_score(self, node, contexts, word2, memo):
+        if node in memo:
+            return memo[node]
+        label = self.graph['nodes'][node]
+        # unigram node: end of every path
+        if label is None:
+            score = self.logprob_uni(word2)
+        else:
+            row = self.bigrams(node, contexts[label])
+            if word2 in row:
+                score = row[word2]
+            else:
+                weight = self.backoffs[node].get(get_signature(node, contexts, self.graph), 0)
+                score = weight + self.backoff_score(node, contexts, word2, memo)
+        memo[node] = score
+        return score
+
+
+    ## gets the combined score of the nodes a node backs off to (no weight)
+    # input: node name, contexts, current word, memo of node scores
+    # output: combined log prob
+    def backoff_score(self, node, contexts, word2, memo):
+        scores = [self.node_score(child, contexts, word2, memo)
+                  for child in self.graph['edges'][node]]
+        return combine(self.graph['combine'].get(node, DEFAULT_COMBINE), scores)
+
+
+
+
+## backoff graph LM with lazily loaded bigram rows
+# input: model file name (from create-lm_graph.py), max resident contexts per node
+class GraphModel(GraphBackoffModel):
+    def __init__(self, model_filename, max_contexts=model.DEFAULT_MAX_CONTEXTS):
+        self.model_filename = model_filename
+        self.model_file = model.IndexedFile(model_filename, max_contexts)
+        # eagerly load the graph, unk, unigrams and backoff weights
+        start, end = self.model_file.sections[GRAPH_SECTION]
+        graph = parse_graph(self.model_file.read_bytes(start, end).split('\n'),
+                            model_filename)
+        backoffs = {}
+        for node in graph['edges']:
+            backoffs[node] = self.model_file.read_section(BACKOFF_PREFIX + node)
+        GraphBackoffModel.__init__(self, graph,
+                                   list(self.model_file.read_section(utils.UNK_SECTION).values())[0],
+                                   self.model_file.read_section(utils.UNI_SECTION),
+                                   backoffs)
+
+
+    ## closes the model file
+    def close(self):
+        self.model_file.close()
+
+
+    ## gets the bigram row of a context at a node
+    # input: node name, context (factor of the previous token)
+    # output: dictionary {word2:log prob} (empty if context was never seen)
+    def bigrams(self, node, context):
+        return self.model_file.bigrams(node, context)
+
+
+
+
+## backoff graph LM held entirely in memory
+# input: graph (from read_graph), model tables from estimate_graph_lm
+# note used while estimating backoff weights (children are scored from memory)
+class DictGraphModel(GraphBackoffModel):
+    def __init__(self, graph, tables):
+        GraphBackoffModel.__init__(self, graph, tables['prob_unk'],
+                                   tables['prob_unigrams'], tables['backoffs'])
+        self.probs = tables['probs']
+
+
+    ## gets the bigram row of a context at a node
+    # input: node name, context (factor of the previous token)
+    # output: dictionary {word2:log prob} (empty if context was never seen)
+    def bigrams(self, node, context):
+        return self.probs[node].get(context, {})
+
+
+
+
+####################################################################
+######################### HELPER FUNCTIONS #########################
+####################################################################
+
+## opens a model file as a backoff graph model or a fixed-chain model
+# input: model file name, max number of resident contexts per dimension/node
+# output: GraphModel if the file starts with a graph section, else IndexedModel
+def open_model(model_filename, max_contexts=model.DEFAULT_MAX_CONTEXTS):
+    with open(model_filename, 'rb') as model_file:
+        first_line = model_file.readline().decode('utf-8').strip()
+    if first_line == utils.get_header(GRAPH_SECTION):
+        return GraphModel(model_filename, max_contexts)
+    return model.IndexedModel(model_filename, max_contexts)
+
+
+## reads a backoff graph file
+# input: graph file name (format: see top of file)
+# output: graph (see parse_graph)
+def read_graph(filename):
+    with open(filename, 'r') as graph_file:
+        return parse_graph(graph_file.readlines(), filename)
+
+
+## parses and checks the lines of a backoff graph
+# input: lines of the graph, name of where they came from (for errors)
+# output: graph {'nodes': {name:label (None for unigram)},
+#                'edges': {name:[backoff node names]}, 'combine': {name:method},
+#                'root': first node, 'order': nodes, each before its backoff nodes}
+def parse_graph(lines, source):
+    nodes = OrderedDict()
+    edges = OrderedDict()
+    combine_methods = {}
+    for line in lines:
+        split_line = line.split('#')[0].split()
+        if not split_line:
+            continue
+        # node name [label]
+        if split_line[0] == 'node' and len(split_line) in (2, 3):
+            nodes[split_line[1]] = split_line[2] if len(split_line) == 3 else None
+        # edge from to
+        elif split_line[0] == 'edge' and len(split_line) == 3:
+            edges.setdefault(split_line[1], []).append(split_line[2])
+        # combine name method
+        elif split_line[0] == 'combine' and len(split_line) == 3 and \
+                split_line[2] in COMBINE_METHODS:
+            combine_methods[split_line[1]] = split_line[2]
+        else:
+            graph_error(source, 'Cannot parse line: ' + line.strip())
+
+    ## check the graph
+    if not nodes:
+        graph_error(source, 'No nodes declared')
+    for name in edges:
+        for child in [name] + edges[name]:
+            if child not in nodes:
+                graph_error(source, 'Edge uses undeclared node ' + child)
+        if nodes[name] is None:
+            graph_error(source, 'Unigram node ' + name + ' cannot back off')
+    for name in nodes:
+        if nodes[name] is not None and name not in edges:
+            graph_error(source, 'Bigram node ' + name + ' has nowhere to back off to')
+
+    graph = {'nodes':nodes, 'edges':edges, 'combine':combine_methods,
+             'root':list(nodes)[0]}
+    graph['order'] = topological_order(graph, source)
+    for name in nodes:
+        if name not in graph['order']:
+            graph_error(source, 'Node ' + name + ' cannot be reached from ' + graph['root'])
+    return graph
+
+
+## orders the nodes reachable from the root so each comes before its backoff nodes
+# input: graph, name of where it came from (for errors)
+# output: list of node names
+def topological_order(graph, source):
+    order = []
+    # 'active' while a node's backoff nodes are being visited, then 'done'
+    state = {}
+
+    def visit(node):
+        if state.get(node) == 'active':
+            graph_error(source, 'Backoff graph has a cycle through ' + node)
+        if state.get(node) == 'done':
+            return
+        state[node] = 'active'
+        for child in graph['edges'].get(node, []):
+            visit(child)
+        state[node] = 'done'
+        order.append(node)
+
+    visit(graph['root'])
+    order.reverse()
+    return order
+
+
+## writes an error about a backoff graph and exits
+# input: name of where the graph came from, message
+# output: none (exits)
+def graph_error(source, message):
+    sys.stderr.write('Backoff graph ' + source + ' not in correct format\n')
+    sys.stderr.write(message + '\n')
+    sys.exit(1)
+
+
+## gets the graph declarations back as lines (for the model file)
+# input: graph
+# output: list of lines
+def graph_lines(graph):
+    lines = []
+    for name in graph['nodes']:
+        label = graph['nodes'][name]
+        lines.append('node ' + name + ('' if label is None else ' ' + label))
+    for name in graph['edges']:
+        for child in graph['edges'][name]:
+            lines.append('edge ' + name + ' ' + child)
+    for name in graph['combine']:
+        lines.append('combine ' + name + ' ' + graph['combine'][name])
+    return lines
+
+
+## gets the factor labels used as contexts in a graph
+# input: graph
+# output: list of labels
+def graph_labels(graph):
+    labels = []
+    for name in graph['nodes']:
+        label = graph['nodes'][name]
+        if label is not None and label not in labels:
+            labels.append(label)
+    return labels
+
+
+## gets the contexts of a previous token for a graph
+# input: token (W-word|S-small|L-large), graph
+# output: dictionary {label:factor}
+def get_contexts(token, graph):
+    contexts = {}
+    for label in graph_labels(graph):
+        contexts[label] = utils.get_part(token, label)
+    return contexts
+
+
+## gets the context labels of the nodes a node backs off to, directly or not
+# input: node name, graph
+# output: list of labels (in graph_labels order)
+def reachable_labels(node, graph):
+    reached = set()
+    stack = list(graph['edges'].get(node, []))
+    while stack:
+        child = stack.pop()
+        if child not in reached:
+            reached.add(child)
+            stack.extend(graph['edges'].get(child, []))
+    reached_labels = set(graph['nodes'][child] for child in reached)
+    return [label for label in graph_labels(graph) if label in reached_labels]
+
+
+## gets the backoff signature of a node: its context and its backoff nodes' contexts
+# input: node name, contexts {label:factor}, graph
+# output: signature string (contexts separated by spaces)
+def get_signature(node, contexts, graph):
+    signature = [contexts[graph['nodes'][node]]]
+    for child in graph['edges'][node]:
+        label = graph['nodes'][child]
+        if label is not None:
+            signature.append(contexts[label])
+    return ' '.join(signature)
+
+
+## combines the log probs of several backoff nodes
+# input: combination method (see COMBINE_METHODS), list of log probs
+# output: combined log prob
+def combine(method, scores):
+    if len(scores) == 1:
+        return scores[0]
+    if method == 'max':
+        return max(scores)
+    elif method == 'mean':
+        # mean of the probs (not the log probs), computed in log space
+        top = max(scores)
+        return top + log(sum(10 ** (score - top) for score in scores) / len(scores), 10)
+    else:
+        # product of the probs
+        return sum(scores)
+
+
+## gets the unigram counts and the bigram counts for each context label of a graph
+# input: training file name (tokens W-word|S-small|L-large), graph
+# output: dictionary of counts
+#         {'unigrams': {word:count}, 'total_word_count': number of tokens,
+#          'factors': {label:{factor:count}}, 'bigrams': {label:{factor:{word2:count}}},
+#          'prev_contexts': (factor for each label in graph_labels) of previous
+#                           tokens seen in training, in first-seen order (keys
+#                           of an OrderedDict, so the backoff sections are
+#                           written in the same order every run)}
+def count_graph_ngrams(filename, graph):
+    labels = graph_labels(graph)
+    unigrams = {}
+    factors = dict((label, {}) for label in labels)
+    bigrams = dict((label, {}) for label in labels)
+    prev_contexts = OrderedDict()
+    total_word_count = 0
+
+    with open(filename, 'r') as training_file:
+        # read through line by line (one sentence per line)
+        for line in training_file:
+            prev_parts = None
+            for word in line.strip().split(' '):
+                total_word_count += 1
+                word2 = utils.get_part(word, WORD_LABEL)
+                parts = tuple(utils.get_part(word, label) for label in labels)
+
+                # unigram counts of the word and of each context factor
+                utils.add_uni_counts(word2, unigrams)
+                for label, part in zip(labels, parts):
+                    utils.add_uni_counts(part, factors[label])
+
+                # bigram counts (from the second word on)
+                if prev_parts is not None:
+                    prev_contexts[prev_parts] = True
+                    for label, part in zip(labels, prev_parts):
+                        utils.add_bi_counts(part, word2, bigrams[label])
+                prev_parts = parts
+
+    return {'unigrams':unigrams, 'total_word_count':total_word_count,
+            'factors':factors, 'bigrams':bigrams, 'prev_contexts':prev_contexts}
+
+
+## calculates probabilities and backoff weights for every node of a graph
+# input: counts from count_graph_ngrams, graph, discounting method and discount
+#        (see utils.estimate_lm), whether to write progress messages to stderr
+# output: dictionary of model tables
+#         {'prob_unk': unk log prob, 'prob_unigrams': {word:log prob},
+#          'probs': {node:{context:{word2:log prob}}},
+#          'backoffs': {node:{signature:log backoff}}}
+def estimate_graph_lm(counts, graph, discount_method='good-turing', discount=None,
+                      verbose=False):
+    unigrams = counts['unigrams']
+
+    ## unigram and unk probabilities
+    count_unigrams = utils.get_counts_uni(unigrams)
+    disc_uni = utils.get_discounts(count_unigrams, discount_method, discount)
+    prob_unigrams = utils.probs_uni(unigrams, counts['total_word_count'], disc_uni)
+    # unknowns (GT estimate): count(words appearing once) / |V|
+    prob_unk = log(count_unigrams[1], 10) - log(len(unigrams), 10)
+
+    ## bigram probabilities of each node
+    probs = {}
+    for node in graph['order']:
+        label = graph['nodes'][node]
+        if label is None:
+            continue
+        disc = utils.get_discounts(utils.get_counts_bi(counts['bigrams'][label]),
+                                   discount_method, discount)
+        probs[node] = utils.probs_bi(counts['bigrams'][label], counts['factors'][label], disc)
+    if verbose:
+        sys.stderr.write('Finished getting probability dictionaries\n')
+
+    ## backoff weights, starting from the end of the graph
+    # (a node's weight needs the full scores of the nodes it backs off to)
+    tables = {'prob_unk':prob_unk, 'prob_unigrams':prob_unigrams,
+              'probs':probs, 'backoffs':{}}
+    scorer = DictGraphModel(graph, tables)
+    for node in reversed(graph['order']):
+        if node in graph['edges']:
+            tables['backoffs'][node] = calc_backoff_graph(scorer, node, counts['prev_contexts'])
+            if verbose:
+                sys.stderr.write('Finished getting ' + node + ' backoff dictionary\n')
+
+    return tables
+
+
+## calculates backoff weights of a node for each backoff signature seen in training
+# input: in-memory model (backoff nodes already estimated), node name,
+#        contexts of previous tokens seen in training (see count_graph_ngrams)
+# output: dictionary mapping signature to backoff weights
+# note the weight is (1 - sum of seen probs) / (sum of unseen combined backoff
+#      probs); if the combined probs sum to one (one backoff node, or mean) the
+#      denominator is 1 - sum of seen ones, as in utils; for max and product
+#      it is the vocabulary total (kept per backoff context) - sum of seen ones
+def calc_backoff_graph(scorer, node, prev_contexts):
+    graph = scorer.graph
+    labels = graph_labels(graph)
+    normalized = (len(graph['edges'][node]) == 1 or
+                  graph['combine'].get(node, DEFAULT_COMBINE) in NORMALIZED_COMBINE)
+    backoff_labels = reachable_labels(node, graph)
+    backoff_totals = {}
+    backoff_weights = {}
+    for prev_parts in prev_contexts:
+        contexts = dict(zip(labels, prev_parts))
+        signature = get_signature(node, contexts, graph)
+        if signature in backoff_weights:
+            continue
+        # keep track of probs
+        prev_prob = 0
+        curr_prob = 0
+        # loop through each word2 seen after the node's context
+        row = scorer.bigrams(node, contexts[graph['nodes'][node]])
+        for word2 in row:
+            # add the node's prob (for numerator) -- note NOT log prob
+            prev_prob += 10 ** row[word2]
+            # add the combined backoff prob (for denominator) -- also NOT log prob
+            curr_prob += 10 ** scorer.backoff_score(node, contexts, word2, {})
+        if not normalized:
+            # total over the vocabulary, for the contexts the backoff nodes see
+            key = tuple(contexts[label] for label in backoff_labels)
+            if key not in backoff_totals:
+                backoff_totals[key] = sum(10 ** scorer.backoff_score(node, contexts, word2, {})
+                                          for word2 in scorer.prob_unigrams)
+            # so that 1 - curr_prob is the unseen total
+            curr_prob = 1 - (backoff_totals[key] - curr_prob)
+        # now add to dict (same formula and fallback as the fixed chain)
+        backoff_weights[signature] = utils.calc_backoff_weight(prev_prob, curr_prob)
+
+    return backoff_weights
+
+
+## writes a backoff graph LM to a file
+# input: graph, model tables from estimate_graph_lm, open output file
+# output: none (model written)
+def write_graph_lm(graph, tables, outfile):
+    # graph first (so the model can be recognized, see open_model)
+    outfile.write(utils.get_header(GRAPH_SECTION) + '\n')
+    for line in graph_lines(graph):
+        outfile.write(line + '\n')
+
+    # unknown and unigram probs
+    utils.write_section(outfile, utils.UNK_HEADER, {'<unk>':tables['prob_unk']})
+    utils.write_section(outfile, utils.UNI_HEADER, tables['prob_unigrams'])
+
+    # bigram probs of each node (one context at a time, see model.build_index)
+    for node in graph['order']:
+        if node in tables['probs']:
+            utils.write_bigram_section(outfile, utils.get_header(utils.BIGRAM_PREFIX + node),
+                                       tables['probs'][node])
+
+    # backoff weights of each node
+    for node in graph['order']:
+        if node in tables['backoffs']:
+            utils.write_section(outfile, utils.get_header(BACKOFF_PREFIX + node),
+                                tables['backoffs'][node])
@@ -0,0 +1,79 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Creates LM for FLMs with multidimensional backoff along a backoff graph (bigram)
+Usage: ./create-lm_graph.py training_file graph_file > output_file
+Training file format: 
+    - one sentence per line
+    - words separated by space
+    - words in the format W-word|S-small_cluster|L-large_cluster
+      (any factor labels used in the graph file)
+
+Graph file format:
+    - see backoff_graph.py (2g3c.graph is the backoff of create-lm_2g3c.py)
+    - nodes can back off to several nodes (parallel backoff), and clusters
+      do not need to be nested
+
+Output file format: 
+    - similar to the output of create-lm_2g3c.py, with the graph first, one
+      section per bigram node and one backoff section per node
+    - can be read with backoff_graph.open_model (e.g. in rescore-lm_2g3c.py)
+
+Created on Tue Oct 20 11:02:51 2026
+"""
+
+## TO DO ##
+#  1. count cutoffs per node
+
+import argparse, sys, utils, backoff_graph
+
+__version__ = '1.0'
+
+
+## main function
+def main():
+    ## parse command-line arguments
+    parser = get_parser()
+    args = vars(parser.parse_args())
+    utils.check_discount(args['discount_method'], args['discount'])
+    graph = backoff_graph.read_graph(args['graph_file'])
+
+    ## get the counts for every context label in the graph
+    counts = backoff_graph.count_graph_ngrams(args['training_file'], graph)
+    sys.stderr.write('Finished getting ngram count dictionaries\n')
+
+    ## probabilities and backoff weights of every node
+    tables = backoff_graph.estimate_graph_lm(counts, graph, args['discount_method'],
+                                             args['discount'], verbose=True)
+
+    ## print the model to stdout
+    backoff_graph.write_graph_lm(graph, tables, sys.stdout)
+
+
+## parsing command-line arguments
+def get_parser():
+    parser = argparse.ArgumentParser()
+
+    # training data file (required argument)
+    parser.add_argument('training_file', help='file containing training data',
+                        metavar='training_file', type=str)
+    # backoff graph file (required argument)
+    parser.add_argument('graph_file', help='file declaring the backoff graph',
+                        metavar='graph_file', type=str)
+    # discounting method (optional)
+    parser.add_argument('--discount-method', help='discounting method (default good-turing)',
+                        dest='discount_method', choices=utils.DISCOUNT_METHODS,
+                        default='good-turing')
+    # discount for absolute discounting (optional)
+    parser.add_argument('--discount', help='discount for absolute discounting (0-1)',
+                        type=float, default=0.7)
+    # version info (optional)
+    parser.add_argument('-v', '--version', help='displays current version',
+                        action='version', version='%(prog)s '+__version__)
+
+    return parser
+
+
+## execute the code
+if __name__ == '__main__':
+    main()
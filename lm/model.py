@@ -0,0 +1,520 @@
+# -*- coding: utf-8 -*-
+"""
+Indexed, lazily loaded container for multidimensional backoff LMs
+(the output of create-lm_2g3c.py)
+
+The model file is only ever read once in full, to build a small index file
+next to it (model_file + '.idx'). The index stores the byte offsets of each
+section and of each context's rows in the ww/sw/lw bigram blocks. After that,
+opening the model only reads the index, the unk probability, the unigrams and
+the backoff weights; the bigram rows for a context are read from disk the first
+time that context is queried and kept in an LRU cache.
+
+Scoring (backoff, top-k, perplexity) is in BackoffModel; IndexedModel reads
+its bigram rows from the model file (through IndexedFile) and DictModel holds
+them in memory.
+
+Index file format:
+    \\model:
+    size<TAB>model file size in bytes (used to detect a stale index)
+    \\sections:
+    start<TAB>end<TAB>section name
+    \\contexts ww: (also sw, lw)
+    start<TAB>end<TAB>context
+
+Created on Mon Oct 19 10:12:40 2026
+"""
+
+## TO DO ##
+#  1. the index assumes the rows of a context are contiguous in each bigram
+#     block (true for create-lm_2g3c.py, since it writes one context at a time)
+#  2. allow an mmap-backed reader instead of seek/read for very hot models
+
+from __future__ import division
+from collections import OrderedDict
+import heapq, os, sys, utils
+
+# variables for word, small cluster, and large cluster labels
+# (same as in create-lm_2g3c.py)
+WORD_LABEL = 'W'
+SMALL_LABEL = 'S'
+LARGE_LABEL = 'L'
+
+# the bigram dimensions (section utils.BIGRAM_PREFIX + dimension), in backoff order
+DIMENSIONS = ['ww', 'sw', 'lw']
+
+# extension of the index file written next to the model
+INDEX_EXT = '.idx'
+
+# default number of contexts (per dimension) kept in memory
+DEFAULT_MAX_CONTEXTS = 10000
+
+
+## scoring shared by all models (fixed chain or backoff graph)
+# input: unk log prob, unigram log probs {word:log prob}
+# note subclasses implement logprob(prev_token, token)
+class LanguageModel(object):
+    def __init__(self, prob_unk, prob_unigrams):
+        self.prob_unk = prob_unk
+        self.prob_unigrams = prob_unigrams
+
+
+    ## nothing to close (models reading from disk override this)
+    def close(self):
+        return
+
+
+    ## gets the unigram log prob of a word (unk prob if out of vocabulary)
+    # input: word
+    # output: log prob
+    def logprob_uni(self, word):
+        return self.prob_unigrams.get(word, self.prob_unk)
+
+
+    ## gets the total log prob of a sentence
+    # input: list of tokens (W-word|S-small|L-large)
+    # output: sum of log probs (first word scored as a unigram)
+    def score_sentence(self, tokens):
+        total = 0
+        prev_token = None
+        for token in tokens:
+            total += self.logprob(prev_token, token)
+            prev_token = token
+        return total
+
+
+    ## gets the perplexity of a file of sentences
+    # input: file name (one sentence per line, tokens W-word|S-small|L-large)
+    # output: perplexity (10 ** -(average log prob per token))
+    def perplexity(self, filename):
+        total = 0
+        num_tokens = 0
+        with open(filename, 'r') as test_file:
+            for line in test_file:
+                tokens = line.split()
+                total += self.score_sentence(tokens)
+                num_tokens += len(tokens)
+        # very bad models (e.g. -1000 backoffs) can overflow
+        try:
+            return 10 ** (-total / num_tokens)
+        except OverflowError:
+            return float('inf')
+
+
+
+
+## multidimensional backoff LM (ww -> sw -> lw -> unigram)
+# input: unk log prob, unigram log probs, backoff weights from word to small
+#        cluster, small to large cluster and large cluster to unigram
+# note subclasses hold the bigram rows: they implement bigrams(dimension, context)
+#      and ranked_bigrams(dimension, context)
+class BackoffModel(LanguageModel):
+    def __init__(self, prob_unk, prob_unigrams, backoff_ws, backoff_sl, backoff_l):
+        LanguageModel.__init__(self, prob_unk, prob_unigrams)
+        self.backoff_ws = backoff_ws
+        self.backoff_sl = backoff_sl
+        self.backoff_l = backoff_l
+        # all unigrams sorted by prob (built on first top-k query)
+        self.ranked_unigrams = None
+
+
+    ## gets the log prob of a bigram (or of a unigram if no previous token)
+    # input: previous token and current token (W-word|S-small|L-large)
+    # output: log prob of token given prev token, backing off ww -> sw -> lw -> unigram
+    def logprob(self, prev_token, token):
+        return self.logprob_parts(get_parts(prev_token) if prev_token else None,
+                                  utils.get_part(token, WORD_LABEL))
+
+
+    ## same as logprob, but with the previous token already split into parts
+    # input: (word1, small1, large1) or None, current word
+    # output: log prob of word2 given prev parts
+    def logprob_parts(self, prev_parts, word2):
+        # start of sentence: unigram only
+        if prev_parts is None:
+            return self.logprob_uni(word2)
+        word1, small1, large1 = prev_parts
+
+        # word-word bigram
+        row = self.bigrams('ww', word1)
+        if word2 in row:
+            return row[word2]
+        # back off to small cluster
+        weight = self.backoff_ws.get(word1, 0)
+        row = self.bigrams('sw', small1)
+        if word2 in row:
+            return weight + row[word2]
+        # back off to large cluster
+        weight += self.backoff_sl.get(small1, 0)
+        row = self.bigrams('lw', large1)
+        if word2 in row:
+            return weight + row[word2]
+        # back off to unigram
+        weight += self.backoff_l.get(large1, 0)
+        return weight + self.logprob_uni(word2)
+
+
+    ## gets the k most probable next words after a token
+    # input: previous token (W-word|S-small|L-large, or None for start of sentence), k
+    # output: list [(log prob, word2)] of length <= k, most probable first
+    # note each word is scored by the first dimension that contains it
+    #      (ww, then sw, then lw, then unigram), so the four sorted lists are
+    #      merged lazily with their backoff weights and a word is skipped in a
+    #      list if an earlier dimension already covers it; this only touches
+    #      the top of each list rather than scoring the whole vocabulary
+    def top_k(self, prev_token, k):
+        if self.ranked_unigrams is None:
+            self.ranked_unigrams = rank(self.prob_unigrams)
+        # start of sentence: unigram only
+        if prev_token is None:
+            return self.ranked_unigrams[:k]
+        word1, small1, large1 = get_parts(prev_token)
+
+        ## the sorted lists in backoff order, with the weight to add to each
+        rows = [self.bigrams('ww', word1), self.bigrams('sw', small1),
+                self.bigrams('lw', large1)]
+        weight_sw = self.backoff_ws.get(word1, 0)
+        weight_lw = weight_sw + self.backoff_sl.get(small1, 0)
+        weight_uni = weight_lw + self.backoff_l.get(large1, 0)
+        streams = [(self.ranked_bigrams('ww', word1), 0),
+                   (self.ranked_bigrams('sw', small1), weight_sw),
+                   (self.ranked_bigrams('lw', large1), weight_lw),
+                   (self.ranked_unigrams, weight_uni)]
+
+        ## merge the heads of the lists (heap of negated scores)
+        heap = []
+        for index, (ranked, weight) in enumerate(streams):
+            if ranked:
+                heapq.heappush(heap, (-(ranked[0][0] + weight), index, 0))
+        best = []
+        while heap and len(best) < k:
+            neg_score, index, position = heapq.heappop(heap)
+            ranked, weight = streams[index]
+            word2 = ranked[position][1]
+            # only keep the word if no earlier dimension covers it
+            if not any(word2 in row for row in rows[:index]):
+                best.append((-neg_score, word2))
+            # advance this list
+            if position + 1 < len(ranked):
+                heapq.heappush(heap, (-(ranked[position + 1][0] + weight), index,
+                                      position + 1))
+        return best
+
+
+    ## gets the total log prob of a sentence (splits each token only once)
+    # input: list of tokens (W-word|S-small|L-large)
+    # output: sum of log probs (first word scored as a unigram)
+    def score_sentence(self, tokens):
+        total = 0
+        prev_parts = None
+        for token in tokens:
+            parts = get_parts(token)
+            total += self.logprob_parts(prev_parts, parts[0])
+            prev_parts = parts
+        return total
+
+
+
+
+## multidimensional backoff LM with lazily loaded bigram rows
+# input: model file name, max number of resident contexts per dimension
+# note builds (or rebuilds) the index the first time the model is opened
+class IndexedModel(BackoffModel):
+    def __init__(self, model_filename, max_contexts=DEFAULT_MAX_CONTEXTS):
+        self.model_filename = model_filename
+        self.model_file = IndexedFile(model_filename, max_contexts)
+        BackoffModel.__init__(self,
+                              list(self.model_file.read_section(utils.UNK_SECTION).values())[0],
+                              self.model_file.read_section(utils.UNI_SECTION),
+                              self.model_file.read_section(utils.BACKOFF_WS_SECTION),
+                              self.model_file.read_section(utils.BACKOFF_SL_SECTION),
+                              self.model_file.read_section(utils.BACKOFF_L_SECTION))
+
+
+    ## closes the model file
+    def close(self):
+        self.model_file.close()
+
+
+    ## gets the bigram row of a context in one dimension
+    # input: dimension ('ww', 'sw' or 'lw'), context (word or cluster)
+    # output: dictionary {word2:log prob} (empty if context was never seen)
+    def bigrams(self, dimension, context):
+        return self.model_file.bigrams(dimension, context)
+
+
+    ## gets the bigram row of a context sorted by probability (for top-k)
+    # input: dimension ('ww', 'sw' or 'lw'), context (word or cluster)
+    # output: list [(log prob, word2)], most probable first
+    def ranked_bigrams(self, dimension, context):
+        return self.model_file.ranked_bigrams(dimension, context)
+
+
+
+
+## multidimensional backoff LM held entirely in memory
+# input: model tables from utils.estimate_lm
+# note used to score models that were never written to disk (e.g. when tuning)
+class DictModel(BackoffModel):
+    def __init__(self, tables):
+        BackoffModel.__init__(self, tables['prob_unk'], tables['prob_unigrams'],
+                              tables['backoff_ws'], tables['backoff_sl'],
+                              tables['backoff_l'])
+        # all bigram rows {dimension:{context:{word2:prob}}}
+        self.probs = {'ww':tables['prob_ww'], 'sw':tables['prob_sw'],
+                      'lw':tables['prob_lw']}
+        # rows sorted by prob for top-k {dimension:{context:[(prob, word2)]}}
+        self.ranked_cache = dict((dim, OrderedDict()) for dim in DIMENSIONS)
+
+
+    ## gets the bigram row of a context in one dimension
+    # input: dimension ('ww', 'sw' or 'lw'), context (word or cluster)
+    # output: dictionary {word2:log prob} (empty if context was never seen)
+    def bigrams(self, dimension, context):
+        return self.probs[dimension].get(context, {})
+
+
+    ## gets the bigram row of a context sorted by probability (for top-k)
+    # input: dimension ('ww', 'sw' or 'lw'), context (word or cluster)
+    # output: list [(log prob, word2)], most probable first
+    def ranked_bigrams(self, dimension, context):
+        cache = self.ranked_cache[dimension]
+        if context not in cache:
+            cache[context] = rank(self.bigrams(dimension, context))
+            # keep at most as many sorted rows as a lazily loaded model
+            if len(cache) > DEFAULT_MAX_CONTEXTS:
+                cache.popitem(last=False)
+        return cache[context]
+
+
+
+
+## model file with a section index and an LRU cache of bigram rows
+# input: model file name, max number of resident contexts per dimension
+# note builds (or rebuilds) the index if it is missing or stale; every
+#      '2-grams X' section is a dimension X (see build_index)
+class IndexedFile(object):
+    def __init__(self, model_filename, max_contexts=DEFAULT_MAX_CONTEXTS):
+        self.max_contexts = max_contexts
+
+        # load the index (building it if it is missing or stale)
+        index_filename = model_filename + INDEX_EXT
+        if not index_is_current(model_filename, index_filename):
+            build_index(model_filename, index_filename)
+        self.sections, self.contexts = read_index(index_filename)
+
+        # bigram rows that are in memory, each with the same row sorted by
+        # prob once top-k needs it (so both are evicted together)
+        # {dimension:{context:[{word2:prob}, [(prob, word2)] or None]}}
+        self.cache = dict((dim, OrderedDict()) for dim in self.contexts)
+
+        self.model_file = open(model_filename, 'rb')
+
+
+    ## closes the model file
+    def close(self):
+        self.model_file.close()
+
+
+    ## reads a whole (small) section of the model file
+    # input: section name
+    # output: dictionary {key:log prob/backoff}
+    def read_section(self, section):
+        start, end = self.sections[section]
+        return parse_rows(self.read_bytes(start, end), False)
+
+
+    ## reads a byte range of the model file
+    # input: start and end offsets
+    # output: decoded text
+    def read_bytes(self, start, end):
+        self.model_file.seek(start)
+        return self.model_file.read(end - start).decode('utf-8')
+
+
+    ## gets the bigram row of a context in one dimension
+    # input: dimension (e.g. 'ww', 'sw' or 'lw'), context (word or cluster)
+    # output: dictionary {word2:log prob} (empty if context was never seen)
+    def bigrams(self, dimension, context):
+        entry = self.lru_lookup(dimension, context)
+        if entry is None:
+            return {}
+        return entry[0]
+
+
+    ## gets the bigram row of a context sorted by probability (for top-k)
+    # input: dimension (e.g. 'ww', 'sw' or 'lw'), context (word or cluster)
+    # output: list [(log prob, word2)], most probable first
+    def ranked_bigrams(self, dimension, context):
+        entry = self.lru_lookup(dimension, context)
+        if entry is None:
+            return []
+        # sort the row the first time top-k needs it
+        if entry[1] is None:
+            entry[1] = rank(entry[0])
+        return entry[1]
+
+
+    ## looks up a context in the LRU cache, reading its row if it is not resident
+    # input: dimension, context
+    # output: cache entry [row, sorted row or None] (None if the context was
+    #         never seen in training; such contexts are not cached)
+    def lru_lookup(self, dimension, context):
+        cache = self.cache[dimension]
+        # already resident: mark as most recently used
+        if context in cache:
+            entry = cache.pop(context)
+            cache[context] = entry
+            return entry
+        # never seen in training: nothing to read or cache
+        if context not in self.contexts[dimension]:
+            return None
+        entry = [self.load_bigrams(dimension, context), None]
+        cache[context] = entry
+        # evict the least recently used context (and its sorted row) if over the cap
+        if len(cache) > self.max_contexts:
+            cache.popitem(last=False)
+        return entry
+
+
+    ## reads the bigram row of a context from disk
+    # input: dimension, context
+    # output: dictionary {word2:log prob}
+    def load_bigrams(self, dimension, context):
+        start, end = self.contexts[dimension][context]
+        return parse_rows(self.read_bytes(start, end), True)
+
+
+
+
+####################################################################
+######################### HELPER FUNCTIONS #########################
+####################################################################
+
+## splits a token into word, small cluster and large cluster
+# input: token in format W-word|S-small|L-large
+# output: (word, small cluster, large cluster)
+def get_parts(token):
+    return (utils.get_part(token, WORD_LABEL), utils.get_part(token, SMALL_LABEL),
+            utils.get_part(token, LARGE_LABEL))
+
+
+## checks whether an index file exists and matches the model file
+# input: model file name, index file name
+# output: True if the index can be used as is
+def index_is_current(model_filename, index_filename):
+    if not os.path.exists(index_filename):
+        return False
+    # compare the model size recorded in the index with the actual size
+    with open(index_filename, 'rb') as index_file:
+        index_file.readline()
+        recorded_size = index_file.readline().decode('utf-8').strip().split('\t')[1]
+    return int(recorded_size) == os.path.getsize(model_filename) and \
+        os.path.getmtime(index_filename) >= os.path.getmtime(model_filename)
+
+
+## scans a model file once and writes its section and context offsets
+# input: model file name, index file name
+# output: none (index file written)
+def build_index(model_filename, index_filename):
+    # {section:[start, end]} and {dimension:[(context, start, end)]}
+    # note every '2-grams X' section is indexed as dimension X (so backoff
+    #      graph models, with one section per node, are indexed too)
+    sections = OrderedDict()
+    contexts = OrderedDict()
+
+    section = None
+    dimension = None
+    context = None
+    offset = 0
+    with open(model_filename, 'rb') as model_file:
+        for line in iter(model_file.readline, b''):
+            text = line.decode('utf-8').rstrip('\n')
+            # section header (e.g. \2-grams ww:)
+            if text.startswith('\\') and text.endswith(':'):
+                # close the previous section (and its last context)
+                if section is not None:
+                    sections[section][1] = offset
+                if context is not None:
+                    contexts[dimension][-1][2] = offset
+                section = text[1:-1]
+                sections[section] = [offset + len(line), offset + len(line)]
+                dimension = None
+                if section.startswith(utils.BIGRAM_PREFIX):
+                    dimension = section[len(utils.BIGRAM_PREFIX):]
+                    contexts[dimension] = []
+                context = None
+            # bigram row: prob<TAB>context word2
+            elif dimension is not None and text:
+                row_context = text.split('\t')[1].split(' ')[0]
+                if row_context != context:
+                    if context is not None:
+                        contexts[dimension][-1][2] = offset
+                    contexts[dimension].append([row_context, offset, offset])
+                    context = row_context
+            offset += len(line)
+    # close the final section
+    if section is not None:
+        sections[section][1] = offset
+    if context is not None:
+        contexts[dimension][-1][2] = offset
+
+    ## write the index
+    with open(index_filename, 'wb') as index_file:
+        index_file.write(b'\\model:\n')
+        index_file.write(('size\t' + str(offset) + '\n').encode('utf-8'))
+        index_file.write(b'\\sections:\n')
+        for name in sections:
+            start, end = sections[name]
+            index_file.write((str(start) + '\t' + str(end) + '\t' + name + '\n').encode('utf-8'))
+        for dim in contexts:
+            index_file.write(('\\contexts ' + dim + ':\n').encode('utf-8'))
+            for name, start, end in contexts[dim]:
+                index_file.write((str(start) + '\t' + str(end) + '\t' + name + '\n').encode('utf-8'))
+
+    sys.stderr.write('Wrote model index to ' + index_filename + '\n')
+
+
+## reads an index file written by build_index
+# input: index file name
+# output: {section:(start, end)}, {dimension:{context:(start, end)}}
+def read_index(index_filename):
+    sections = {}
+    contexts = {}
+    # the dict the current block of lines goes into
+    target = None
+    with open(index_filename, 'rb') as index_file:
+        for line in index_file:
+            text = line.decode('utf-8').rstrip('\n')
+            if text == '\\model:':
+                target = None
+            elif text == '\\sections:':
+                target = sections
+            elif text.startswith('\\contexts '):
+                target = contexts.setdefault(text[len('\\contexts '):-1], {})
+            elif target is not None and text:
+                start, end, name = text.split('\t', 2)
+                target[name] = (int(start), int(end))
+    return sections, contexts
+
+
+## sorts a probability dictionary by probability
+# input: dictionary {word:log prob}
+# output: list [(log prob, word)], most probable first
+def rank(prob_dict):
+    return sorted(((prob_dict[word], word) for word in prob_dict), reverse=True)
+
+
+## parses rows of the model file (prob<TAB>key)
+# input: text of the rows, whether rows are bigrams (prob<TAB>context word2)
+# output: dictionary {key:prob} (key is word2 for bigrams)
+def parse_rows(text, bigram):
+    rows = {}
+    for line in text.split('\n'):
+        if not line:
+            continue
+        prob, key = line.split('\t', 1)
+        if bigram:
+            key = key.split(' ', 1)[1]
+        rows[key] = float(prob)
+    return rows
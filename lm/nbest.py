@@ -0,0 +1,153 @@
+# -*- coding: utf-8 -*-
+"""
+Helper functions for rescoring n-best lists and lattices with multidimensional
+backoff LMs (see rescore-lm_2g3c.py)
+
+Hypotheses that share a prefix share its score: the hypotheses of a sentence
+are put into a prefix trie and each trie node is scored once from its parent.
+On top of that, the score of each distinct (previous token, token) edge is
+computed only once per sentence, since a bigram score does not depend on
+anything before the previous token.
+
+N-best file format (Moses style, hypotheses of a sentence on consecutive lines):
+    sentence_id ||| hypothesis tokens ||| any other fields (ignored)
+
+Lattice file format (one lattice per block, blocks separated by a blank line):
+    lattice_id
+    from_node to_node token
+    ...
+    - paths start at node 0 and end at any node without outgoing edges
+
+Tokens are in the format W-word|S-small_cluster|L-large_cluster.
+
+Created on Mon Oct 19 14:41:08 2026
+"""
+
+## TO DO ##
+#  1. lattice hypotheses are enumerated path by path (exponential in the
+#     worst case); add a best-path mode that only keeps one score per node
+#  2. allow the edge scores to be shared across sentences (bounded cache)
+
+import sys
+
+# n-best field delimiter
+NBEST_DELIM = ' ||| '
+# token delimiter within a hypothesis
+WORD_DELIM = ' '
+
+
+## reads an n-best list, grouping hypotheses by sentence id
+# input: n-best file name
+# output: generator of (sentence id, [hypothesis token lists])
+def read_nbest(filename):
+    sentence_id = None
+    hypotheses = []
+    with open(filename, 'r') as nbest_file:
+        for line in nbest_file:
+            fields = line.strip().split(NBEST_DELIM.strip())
+            # need at least the sentence id and the hypothesis
+            if len(fields) < 2:
+                sys.stderr.write('N-best file ' + filename + ' not in correct format\n')
+                sys.stderr.write('Line: ' + line)
+                sys.exit(1)
+            line_id = fields[0].strip()
+            tokens = fields[1].split()
+            # new sentence: hand back the previous one
+            if line_id != sentence_id and sentence_id is not None:
+                yield sentence_id, hypotheses
+                hypotheses = []
+            sentence_id = line_id
+            hypotheses.append(tokens)
+    if sentence_id is not None:
+        yield sentence_id, hypotheses
+
+
+## reads a file of lattices
+# input: lattice file name
+# output: generator of (lattice id, {from node:[(to node, token)]})
+def read_lattices(filename):
+    lattice_id = None
+    edges = {}
+    with open(filename, 'r') as lattice_file:
+        for line in lattice_file:
+            line = line.strip()
+            # blank line ends the current lattice
+            if not line:
+                if lattice_id is not None:
+                    yield lattice_id, edges
+                lattice_id = None
+                edges = {}
+            # first line of a block is the lattice id
+            elif lattice_id is None:
+                lattice_id = line
+            else:
+                split_line = line.split()
+                if len(split_line) != 3:
+                    sys.stderr.write('Lattice file ' + filename + ' not in correct format\n')
+                    sys.stderr.write('Line: ' + line + '\n')
+                    sys.exit(1)
+                from_node, to_node, token = split_line
+                edges.setdefault(from_node, []).append((to_node, token))
+    if lattice_id is not None:
+        yield lattice_id, edges
+
+
+## gets the score of an edge, computing it only the first time it is seen
+# input: model, previous token (None at start of sentence), token,
+#        dictionary of edge scores already computed {(prev token, token):score}
+# output: log prob of token given previous token
+def edge_score(model, prev_token, token, edge_scores):
+    edge = (prev_token, token)
+    if edge not in edge_scores:
+        edge_scores[edge] = model.logprob(prev_token, token)
+    return edge_scores[edge]
+
+
+## scores the hypotheses of one sentence using a prefix trie
+# input: model, list of hypotheses (token lists), edge score dictionary
+# output: list of LM scores (same order as hypotheses)
+def score_nbest(model, hypotheses, edge_scores):
+    # trie node format: [score of prefix, {token:child node}]
+    root = [0, {}]
+    scores = []
+    for tokens in hypotheses:
+        node = root
+        prev_token = None
+        for token in tokens:
+            children = node[1]
+            # new prefix: score it from its parent
+            if token not in children:
+                score = node[0] + edge_score(model, prev_token, token, edge_scores)
+                children[token] = [score, {}]
+            node = children[token]
+            prev_token = token
+        scores.append(node[0])
+    return scores
+
+
+## scores every path through a lattice
+# input: model, lattice edges {from node:[(to node, token)]}, edge score dictionary
+# output: list of (path tokens, LM score), in depth-first order
+def score_lattice(model, edges, edge_scores):
+    paths = []
+    # depth-first search; state is (node, path so far, score so far)
+    stack = [('0', [], 0)]
+    while stack:
+        node, tokens, score = stack.pop()
+        # no outgoing edges: end of a path
+        if node not in edges:
+            paths.append((tokens, score))
+            continue
+        prev_token = tokens[-1] if tokens else None
+        # push in reverse so the first edge is explored first
+        for to_node, token in reversed(edges[node]):
+            stack.append((to_node, tokens + [token],
+                          score + edge_score(model, prev_token, token, edge_scores)))
+    return paths
+
+
+## scores each hypothesis separately (no sharing; for benchmarking)
+# input: model, list of hypotheses (token lists)
+# output: list of LM scores
+def score_naive(model, hypotheses):
+    return [model.score_sentence(tokens) for tokens in hypotheses]
@@ -0,0 +1,430 @@
+# -*- coding: utf-8 -*-
+"""
+Parallel estimation of multidimensional backoff LMs (bigram with 3 clusters)
+
+The unigram, ww, sw and lw dimensions are independent until the backoff
+step, so each one (count of counts, discounts, probabilities) is a separate
+job, run in its own worker process. Each backoff table is started as soon as the two
+probability tables it needs are ready:
+    uni, ww, sw, lw  ->  w2s (ww, sw), s2l (sw, lw), l2u (lw, uni)
+
+Counts are not pickled to the workers: each dimension is stored in shared
+arrays (compressed sparse rows: one row of (word2 id, count) per context),
+and the workers write their log probs and backoff weights into shared arrays
+of the same shape. Workers only ever see ids; the words and contexts stay in
+the parent, which builds the model dicts once, when all jobs are done. The
+workers use the same arithmetic as utils (same helpers, same order of sums),
+so the output is identical to utils.estimate_lm.
+
+Created on Tue Oct 20 15:26:44 2026
+"""
+
+## TO DO ##
+#  1. jobs for the three bigram dimensions differ a lot in size (ww is much
+#     bigger); split ww by context so it can use more than one process
+
+from __future__ import division
+from math import log
+from multiprocessing import Process, Queue, RawArray, cpu_count
+import sys, traceback, utils
+try:
+    from queue import Empty
+except ImportError:
+    from Queue import Empty
+
+# the probability jobs and the backoff jobs with the dimensions they need
+# (dimension backing off, dimension backed off to)
+PROB_JOBS = ['uni', 'ww', 'sw', 'lw']
+BACKOFF_JOBS = {'w2s':('ww', 'sw'), 's2l':('sw', 'lw'), 'l2u':('lw', 'uni')}
+
+# how the dimensions map to the count dictionaries (counts, normalizer)
+BIGRAM_COUNTS = {'ww':('bigrams_ww', 'unigrams'), 'sw':('bigrams_sw', 'small_clusters'),
+                 'lw':('bigrams_lw', 'large_clusters')}
+CUTOFF_INDEX = {'ww':0, 'sw':1, 'lw':2}
+# factor mapping from a context to its cluster, and the dimension of that cluster
+BACKOFF_MAPPINGS = {'ww':('word_to_small', 'sw'), 'sw':('small_to_large', 'lw')}
+
+# dicts keep insertion order from python 3.7 (before that, see get_serial_order)
+ORDERED_DICTS = sys.version_info >= (3, 7)
+
+# marks entries of a probability array removed by a cutoff
+# (and contexts of a backoff array that get no weight)
+REMOVED = float('nan')
+
+# seconds to wait for a finished job before checking that the workers are alive
+CHECK_INTERVAL = 1
+
+# shared arrays and settings of a worker process (set by init_worker)
+shared = None
+
+
+## calculates probabilities and backoff weights in worker processes
+# input: counts from utils.count_ngrams, number of processes (None for all cpus),
+#        discounting method, discount and cutoffs (see utils.estimate_lm),
+#        whether to write progress messages to stderr
+# output: dictionary of model tables (same as utils.estimate_lm)
+def estimate_lm_parallel(counts, processes=None, discount_method='good-turing',
+                         discount=None, cutoffs=(0, 0, 0), verbose=False):
+    # check here, before any worker is started
+    utils.check_cutoffs(cutoffs)
+    utils.check_discount(discount_method, discount)
+
+    ## put the counts into shared arrays (the strings stay in this process)
+    arrays, strings = encode_counts(counts, cutoffs)
+    settings = {'discount_method':discount_method, 'discount':discount, 'cutoffs':cutoffs,
+                'total_word_count':counts['total_word_count']}
+    if processes is None:
+        processes = cpu_count()
+
+    ## run the jobs as a dependency graph, one worker process per job
+    # every job that finishes puts (job, error, result) on the queue (see
+    # run_job); a backoff job is started as soon as both of its inputs are done
+    finished = Queue()
+    waiting = list(PROB_JOBS)
+    running = {}
+    results = {}
+    while len(results) < len(PROB_JOBS) + len(BACKOFF_JOBS):
+        while waiting and len(running) < processes:
+            job = waiting.pop(0)
+            running[job] = Process(target=run_job, args=(job, arrays, settings, finished))
+            running[job].start()
+        try:
+            job, error, result = finished.get(timeout=CHECK_INTERVAL)
+        except Empty:
+            # a worker that dies without returning (e.g. killed for using too
+            # much memory) never puts its job on the queue
+            for job in running:
+                if not running[job].is_alive() and running[job].exitcode != 0:
+                    stop_workers(running)
+                    sys.stderr.write('Job ' + job + ' failed: worker process exited with code ' +
+                                     str(running[job].exitcode) + ' without a result\n')
+                    sys.exit(1)
+            continue
+        running.pop(job).join()
+        if error is not None:
+            stop_workers(running)
+            sys.stderr.write('Job ' + job + ' failed in a worker process:\n' + error)
+            sys.exit(1)
+        results[job] = result
+        if verbose:
+            sys.stderr.write('Finished job ' + job + '\n')
+        for backoff in BACKOFF_JOBS:
+            inputs = BACKOFF_JOBS[backoff]
+            if job in inputs and all(name in results for name in inputs):
+                waiting.append(backoff)
+
+    ## build the tables (same order as the serial code)
+    prob_ww = decode_bigram_probs(arrays, strings, 'ww', cutoffs[0])
+    prob_sw = decode_bigram_probs(arrays, strings, 'sw', cutoffs[1])
+    prob_lw = decode_bigram_probs(arrays, strings, 'lw', cutoffs[2])
+    prob_unk = log(results['uni'][1], 10) - log(len(strings['words']), 10)
+    return {'prob_unk':prob_unk, 'prob_unigrams':decode_uni_probs(arrays, strings),
+            'prob_ww':prob_ww, 'prob_sw':prob_sw, 'prob_lw':prob_lw,
+            'backoff_ws':decode_backoffs(arrays, strings, 'ww', prob_ww),
+            'backoff_sl':decode_backoffs(arrays, strings, 'sw', prob_sw),
+            'backoff_l':decode_backoffs(arrays, strings, 'lw', prob_lw)}
+
+
+## stores the shared arrays and settings in a worker process
+# input: arrays from encode_counts, settings (discounting, cutoffs, word count)
+# output: none (module variable set)
+def init_worker(arrays, settings):
+    global shared
+    shared = dict(arrays)
+    shared.update(settings)
+
+
+## runs one job in a worker process
+# input: job name (see PROB_JOBS and BACKOFF_JOBS), arrays from encode_counts,
+#        settings (see init_worker), queue for the result
+# output: none ((job name, traceback or None, result of the job) put on the queue)
+# note errors are put on the queue rather than raised, so the parent can show
+#      the traceback; a worker that dies without it is caught by its exit code
+def run_job(name, arrays, settings, finished):
+    init_worker(arrays, settings)
+    try:
+        if name in BACKOFF_JOBS:
+            finished.put((name, None, backoff_job(name)))
+        else:
+            finished.put((name, None, prob_job(name)))
+    except Exception:
+        finished.put((name, traceback.format_exc(), None))
+
+
+## stops the worker processes still running
+# input: dictionary of running processes by job
+# output: none
+def stop_workers(running):
+    for job in running:
+        running[job].terminate()
+    for job in running:
+        running[job].join()
+
+
+## estimates the probabilities of one dimension
+# input: dimension ('uni', 'ww', 'sw' or 'lw')
+# output: count of counts of the dimension (probs written to the shared array)
+def prob_job(dimension):
+    method = shared['discount_method']
+    discount = shared['discount']
+    if dimension == 'uni':
+        counts = shared['uni_counts']
+        count_dict = get_counts_of_counts(counts)
+        disc = utils.get_discounts(count_dict, method, discount)
+        total = shared['total_word_count']
+        out = shared['uni_probs']
+        # same as utils.probs_uni
+        for index in range(len(counts)):
+            out[index] = disc[counts[index]] + utils.calc_max_likely(counts[index], total)
+        return count_dict
+
+    counts = shared[dimension + '_counts']
+    count_dict = get_counts_of_counts(counts)
+    disc = utils.get_discounts(count_dict, method, discount)
+    cutoff = shared['cutoffs'][CUTOFF_INDEX[dimension]]
+    starts = shared[dimension + '_starts']
+    norms = shared[dimension + '_norms']
+    out = shared[dimension + '_probs']
+    # same as utils.apply_cutoff followed by utils.probs_bi
+    for index in range(len(norms)):
+        for position in range(starts[index], starts[index + 1]):
+            count = counts[position]
+            if count > cutoff:
+                out[position] = disc[count] + utils.calc_max_likely(count, norms[index])
+            else:
+                out[position] = REMOVED
+    return count_dict
+
+
+## calculates one backoff table from two finished probability tables
+# input: backoff job name (see BACKOFF_JOBS)
+# output: none (weights written to the backoff array of the dimension backing off)
+# note probs are summed in the order utils.calc_backoff_bi and
+#      utils.calc_backoff_uni visit them, so the weights are the same to the last bit
+def backoff_job(name):
+    prev_dim, curr_dim = BACKOFF_JOBS[name]
+    starts = shared[prev_dim + '_starts']
+    word_ids = shared[prev_dim + '_words']
+    probs = shared[prev_dim + '_probs']
+    order = shared.get(prev_dim + '_order')
+    out = shared[prev_dim + '_backoffs']
+
+    ## back off to the unigrams: every context gets a weight
+    if curr_dim == 'uni':
+        uni_probs = shared['uni_probs']
+        for index in range(len(out)):
+            prev_prob = 0
+            curr_prob = 0
+            for position in row_positions(starts, order, index):
+                # nan (removed by a cutoff) is the only value not equal to itself
+                if probs[position] != probs[position]:
+                    continue
+                prev_prob += 10 ** probs[position]
+                curr_prob += 10 ** uni_probs[word_ids[position]]
+            out[index] = utils.calc_backoff_weight(prev_prob, curr_prob)
+        return None
+
+    ## back off to a cluster: only contexts with bigrams get a weight
+    # contexts are visited grouped by the row they back off to, so only one row
+    # of the other dimension is turned into a lookup table at a time
+    targets = shared[prev_dim + '_targets']
+    target = None
+    for index in sorted(range(len(out)), key=lambda index: targets[index]):
+        if targets[index] != target:
+            target = targets[index]
+            curr_row = get_row(curr_dim, target)
+        prev_prob = 0
+        curr_prob = 0
+        num_bigrams = 0
+        for position in row_positions(starts, order, index):
+            if probs[position] != probs[position]:
+                continue
+            prev_prob += 10 ** probs[position]
+            curr_prob += 10 ** curr_row[word_ids[position]]
+            num_bigrams += 1
+        if num_bigrams:
+            out[index] = utils.calc_backoff_weight(prev_prob, curr_prob)
+        else:
+            out[index] = REMOVED
+    return None
+
+
+
+
+####################################################################
+######################### HELPER FUNCTIONS #########################
+####################################################################
+
+## puts the counts into shared arrays
+# input: counts from utils.count_ngrams, cutoffs for (ww, sw, lw) bigrams
+# output: dictionary of shared arrays (ids and numbers only)
+#         {'uni_counts', 'uni_probs' (filled in by the workers), and for each
+#          of ww, sw, lw: 'X_starts': start of each context's row,
+#          'X_words': word2 ids, 'X_counts': counts, 'X_norms': normalizer counts,
+#          'X_probs', 'X_backoffs': log probs and backoff weights (filled in
+#          by the workers), and for ww and sw: 'X_targets': row of each
+#          context's cluster in the dimension it backs off to, and before
+#          python 3.7: 'X_order' (see get_serial_order)},
+#         dictionary of the strings the ids refer to
+#         {'words': word vocabulary (unigram order), 'X_contexts': contexts}
+def encode_counts(counts, cutoffs):
+    unigrams = counts['unigrams']
+    words = list(unigrams)
+    word_ids = dict((word, index) for index, word in enumerate(words))
+    strings = {'words':words}
+    arrays = {'uni_counts':RawArray('l', [unigrams[word] for word in words]),
+              'uni_probs':RawArray('d', len(words))}
+
+    for dimension in BIGRAM_COUNTS:
+        bigram_counts = counts[BIGRAM_COUNTS[dimension][0]]
+        normalizer = counts[BIGRAM_COUNTS[dimension][1]]
+        contexts = list(bigram_counts)
+        starts = [0]
+        row_words = []
+        row_counts = []
+        for context in contexts:
+            for word2 in bigram_counts[context]:
+                row_words.append(word_ids[word2])
+                row_counts.append(bigram_counts[context][word2])
+            starts.append(len(row_words))
+        strings[dimension + '_contexts'] = contexts
+        arrays[dimension + '_starts'] = RawArray('l', starts)
+        arrays[dimension + '_words'] = RawArray('l', row_words)
+        arrays[dimension + '_counts'] = RawArray('l', row_counts)
+        arrays[dimension + '_norms'] = RawArray('l', [normalizer[context] for context in contexts])
+        arrays[dimension + '_probs'] = RawArray('d', len(row_words))
+        arrays[dimension + '_backoffs'] = RawArray('d', len(contexts))
+        if not ORDERED_DICTS:
+            arrays[dimension + '_order'] = RawArray('l', get_serial_order(
+                bigram_counts, contexts, cutoffs[CUTOFF_INDEX[dimension]]))
+
+    # row of each context's cluster in the dimension it backs off to
+    for dimension in BACKOFF_MAPPINGS:
+        mapping = counts[BACKOFF_MAPPINGS[dimension][0]]
+        rows = dict((context, index) for index, context
+                    in enumerate(strings[BACKOFF_MAPPINGS[dimension][1] + '_contexts']))
+        arrays[dimension + '_targets'] = RawArray('l', [rows[mapping[context]] for context
+                                                        in strings[dimension + '_contexts']])
+    return arrays, strings
+
+
+## gets the order in which the serial code visits the bigrams of each row
+# input: bigram count dict, its contexts (in row order), cutoff of the dimension
+# output: list of positions in the shared arrays, row by row (bigrams removed
+#         by the cutoff last in their row)
+# note only needed before python 3.7: there, utils.probs_bi (and, with a cutoff,
+#      utils.apply_cutoff) rebuilds each row in hash order, so the backoff sums
+#      go through a row in a different order than the counts
+def get_serial_order(bigram_counts, contexts, cutoff):
+    order = []
+    start = 0
+    for context in contexts:
+        row = bigram_counts[context]
+        positions = dict((word2, start + index) for index, word2 in enumerate(row))
+        kept = [word2 for word2 in row if row[word2] > cutoff]
+        if cutoff > 0:
+            kept = list(dict_in_order((word2, None) for word2 in kept))
+        kept = list(dict_in_order((word2, None) for word2 in kept))
+        order.extend(positions[word2] for word2 in kept)
+        order.extend(positions[word2] for word2 in row if row[word2] <= cutoff)
+        start += len(row)
+    return order
+
+
+## gets the positions of a row in the order its bigrams are summed (in a worker)
+# input: row starts, serial order (None if dicts keep insertion order), row index
+# output: list (or range) of positions in the shared arrays
+def row_positions(starts, order, index):
+    if order is None:
+        return range(starts[index], starts[index + 1])
+    return order[starts[index]:starts[index + 1]]
+
+
+## gets the count of counts dictionary of an array of counts
+# input: counts
+# output: {count:number of ngrams with this count} (same as utils.get_counts_bi)
+def get_counts_of_counts(counts):
+    count_dict = {}
+    for count in counts:
+        utils.add_uni_counts(count, count_dict)
+    return count_dict
+
+
+## gets one row of a bigram dimension as a lookup table (in a worker)
+# input: dimension ('ww', 'sw' or 'lw'), row index
+# output: {word2 id:log prob} (bigrams removed by a cutoff left out)
+def get_row(dimension, index):
+    starts = shared[dimension + '_starts']
+    word_ids = shared[dimension + '_words']
+    probs = shared[dimension + '_probs']
+    row = {}
+    for position in range(starts[index], starts[index + 1]):
+        if probs[position] == probs[position]:
+            row[word_ids[position]] = probs[position]
+    return row
+
+
+## builds the unigram prob dict from the shared arrays
+# input: shared arrays, strings (see encode_counts)
+# output: {word:log prob}
+def decode_uni_probs(arrays, strings):
+    probs = arrays['uni_probs']
+    prob_dict = {}
+    for index, word in enumerate(strings['words']):
+        prob_dict[word] = probs[index]
+    return prob_dict
+
+
+## builds the bigram prob dict from the shared arrays
+# input: shared arrays, strings (see encode_counts), dimension ('ww', 'sw' or 'lw'),
+#        cutoff of the dimension
+# output: {word1:{word2:log prob}} (bigrams removed by a cutoff left out)
+def decode_bigram_probs(arrays, strings, dimension, cutoff):
+    starts = arrays[dimension + '_starts']
+    word_ids = arrays[dimension + '_words']
+    probs = arrays[dimension + '_probs']
+    words = strings['words']
+    prob_dict = {}
+    for index, context in enumerate(strings[dimension + '_contexts']):
+        row = {}
+        for position in range(starts[index], starts[index + 1]):
+            if probs[position] == probs[position]:
+                row[words[word_ids[position]]] = probs[position]
+        prob_dict[context] = row
+    # with a cutoff, the serial code builds the probs from a copy of the counts
+    # (utils.apply_cutoff); copy again so the dict order is the same (python 2)
+    if cutoff > 0:
+        prob_dict = dict_in_order((context, dict_in_order(prob_dict[context].items()))
+                                  for context in prob_dict)
+    return prob_dict
+
+
+## builds the backoff dict of a dimension from the shared arrays
+# input: shared arrays, strings (see encode_counts), dimension ('ww', 'sw' or 'lw'),
+#        prob dict of the dimension (from decode_bigram_probs)
+# output: {context:log backoff}, inserted in the order of the prob dict (as in
+#         the serial code)
+def decode_backoffs(arrays, strings, dimension, prob_dict):
+    weights = arrays[dimension + '_backoffs']
+    rows = dict((context, index) for index, context
+                in enumerate(strings[dimension + '_contexts']))
+    backoff_weights = {}
+    for context in prob_dict:
+        weight = weights[rows[context]]
+        # the fallback comes back from the float array as -1000.0; use the
+        # same value as the serial code so it is written the same way
+        if weight == utils.BACKOFF_FALLBACK:
+            weight = utils.BACKOFF_FALLBACK
+        if weight == weight:
+            backoff_weights[context] = weight
+    return backoff_weights
+
+
+## builds a dict from (key, value) pairs, inserting them in order
+# input: list (or generator) of (key, value)
+# output: dictionary
+def dict_in_order(pairs):
+    dictionary = {}
+    for key, value in pairs:
+        dictionary[key] = value
+    return dictionary
@@ -0,0 +1,142 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Rescores n-best lists or lattices with a multidimensional backoff LM
+(bigram with 3 clusters, created by create-lm_2g3c.py, or a backoff graph LM
+created by create-lm_graph.py)
+Usage: ./rescore-lm_2g3c.py model_file nbest_file > output_file
+       ./rescore-lm_2g3c.py --lattice model_file lattice_file > output_file
+
+Input file format:
+    - n-best: sentence_id ||| hypothesis ||| other fields (ignored)
+    - lattice: see nbest.py
+    - tokens in the format W-word|S-small_cluster|L-large_cluster
+
+Output file format:
+    - one line per hypothesis (lattices: one line per path)
+    - sentence_id ||| hypothesis ||| LM score (log10)
+
+Hypotheses of a sentence share the scores of their common prefixes, and each
+distinct (previous token, token) edge is only scored once. With --benchmark,
+also scores every hypothesis separately (with a second copy of the model, so
+both start from a cold cache) and reports both timings to stderr.
+
+Created on Mon Oct 19 14:58:33 2026
+"""
+
+## TO DO ##
+#  1. add the LM score to the existing feature fields instead of replacing them
+#  2. lattice best-path output
+
+import argparse, sys, time, model, nbest, backoff_graph
+
+__version__ = '1.1'
+
+
+## main function
+def main():
+    ## parse command-line arguments
+    parser = get_parser()
+    args = vars(parser.parse_args())
+    lm = backoff_graph.open_model(args['model_file'], args['max_contexts'])
+    # naive scoring gets its own model, so it starts from a cold cache too
+    # (instead of reusing the rows shared scoring has just loaded)
+    naive_lm = None
+    if args['benchmark']:
+        naive_lm = backoff_graph.open_model(args['model_file'], args['max_contexts'])
+
+    # time spent scoring and number of edges scored
+    trie_time = 0
+    naive_time = 0
+    num_edges = 0
+    num_tokens = 0
+
+    ## lattices: score every path
+    if args['lattice']:
+        for lattice_id, edges in nbest.read_lattices(args['infile']):
+            edge_scores = {}
+            start = time.time()
+            paths = nbest.score_lattice(lm, edges, edge_scores)
+            trie_time += time.time() - start
+            num_edges += len(edge_scores)
+            hypotheses = [tokens for tokens, score in paths]
+            num_tokens += sum(len(tokens) for tokens in hypotheses)
+            if args['benchmark']:
+                naive_time += benchmark(naive_lm, hypotheses, [score for tokens, score in paths])
+            for tokens, score in paths:
+                write_hypothesis(lattice_id, tokens, score)
+
+    ## n-best lists: score with the prefix trie
+    else:
+        for sentence_id, hypotheses in nbest.read_nbest(args['infile']):
+            edge_scores = {}
+            start = time.time()
+            scores = nbest.score_nbest(lm, hypotheses, edge_scores)
+            trie_time += time.time() - start
+            num_edges += len(edge_scores)
+            num_tokens += sum(len(tokens) for tokens in hypotheses)
+            if args['benchmark']:
+                naive_time += benchmark(naive_lm, hypotheses, scores)
+            for tokens, score in zip(hypotheses, scores):
+                write_hypothesis(sentence_id, tokens, score)
+
+    ## report
+    sys.stderr.write('Scored ' + str(num_edges) + ' distinct edges for ' +
+                     str(num_tokens) + ' tokens\n')
+    sys.stderr.write('Shared scoring time: ' + str(trie_time) + ' s\n')
+    if args['benchmark']:
+        sys.stderr.write('Naive scoring time: ' + str(naive_time) + ' s\n')
+
+
+## scores hypotheses one by one and checks they match the shared scores
+# input: model (separate from the one used for shared scoring), hypotheses,
+#        scores from shared scoring
+# output: time taken by naive scoring
+def benchmark(lm, hypotheses, scores):
+    start = time.time()
+    naive_scores = nbest.score_naive(lm, hypotheses)
+    naive_time = time.time() - start
+    for tokens, score, naive_score in zip(hypotheses, scores, naive_scores):
+        if abs(score - naive_score) > 1e-6:
+            sys.stderr.write('Shared and naive scores differ for: ' + ' '.join(tokens) + '\n')
+            sys.exit(1)
+    return naive_time
+
+
+## writes one rescored hypothesis to stdout
+# input: sentence id, hypothesis tokens, LM score
+# output: none (line written)
+def write_hypothesis(sentence_id, tokens, score):
+    sys.stdout.write(sentence_id + nbest.NBEST_DELIM + nbest.WORD_DELIM.join(tokens) +
+                     nbest.NBEST_DELIM + str(score) + '\n')
+
+
+## parsing command-line arguments
+def get_parser():
+    parser = argparse.ArgumentParser()
+
+    # language model file (required argument)
+    parser.add_argument('model_file', metavar='model_file', type=str,
+                        help='file containing the LM (from create-lm_2g3c.py or create-lm_graph.py)')
+    # n-best or lattice file (required argument)
+    parser.add_argument('infile', help='file containing n-best lists (or lattices)',
+                        metavar='infile', type=str)
+    # read lattices instead of n-best lists (optional)
+    parser.add_argument('--lattice', help='infile contains lattices',
+                        action='store_true')
+    # compare with scoring each hypothesis separately (optional)
+    parser.add_argument('--benchmark', help='also time naive per-hypothesis scoring',
+                        action='store_true')
+    # number of resident contexts per dimension (optional)
+    parser.add_argument('--max-contexts', help='max contexts per dimension kept in memory',
+                        dest='max_contexts', type=int, default=model.DEFAULT_MAX_CONTEXTS)
+    # version info (optional)
+    parser.add_argument('-v', '--version', help='displays current version',
+                        action='version', version='%(prog)s '+__version__)
+
+    return parser
+
+
+## execute the code
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,126 @@
+# -*- coding: utf-8 -*-
+"""
+Low-memory estimation of multidimensional backoff LMs (bigram with 3 clusters)
+
+The default estimation (utils.estimate_lm) keeps the counts of all three
+bigram dimensions from the start, and all probability tables until the model
+is written. Here the training file is read once for the unigrams and factor
+mappings, then once per bigram dimension, in the order the model file is
+written (lw, sw, ww). Each dimension's counts are turned into probabilities
+one context at a time (and freed), its section is written straight away, and
+its probabilities are dropped once both backoff tables that use them are done:
+    lw -> backoff l to unigram (lw, uni)
+    sw -> backoff s to l (sw, lw), then lw is freed
+    ww -> backoff w to s (ww, sw), one context at a time, then sw is freed
+so at most two bigram dimensions are in memory at once, and the ww
+probabilities (the biggest table) are never all in memory. The output has the
+same lines as create-lm_2g3c.py without streaming (and, with the ordered dicts
+of Python 3.7+, in the same order).
+
+Created on Wed Oct 21 10:48:19 2026
+"""
+
+## TO DO ##
+#  1. the extra passes over the training file cost time; allow counting one
+#     pass into temporary files per dimension instead
+
+from __future__ import division
+from math import log
+import sys, utils
+
+
+## estimates a model one dimension at a time and writes it as it goes
+# input: training file name, labels of the word, small cluster and large cluster,
+#        discounting method, discount and cutoffs (see utils.estimate_lm),
+#        open output file, whether to write progress messages to stderr
+# output: none (model written to outfile)
+def estimate_lm_streaming(filename, word_label, small_label, large_label, outfile,
+                          discount_method='good-turing', discount=None,
+                          cutoffs=(0, 0, 0), verbose=False):
+    utils.check_cutoffs(cutoffs)
+
+    ## unigrams and factor mappings (small: one entry per word or cluster)
+    counts = utils.count_ngrams(filename, word_label, small_label, large_label,
+                                bigrams=False)
+    unigrams = counts['unigrams']
+    count_unigrams = utils.get_counts_uni(unigrams)
+    disc_uni = utils.get_discounts(count_unigrams, discount_method, discount)
+    prob_unk = log(count_unigrams[1], 10) - log(len(unigrams), 10)
+    prob_unigrams = utils.probs_uni(unigrams, counts['total_word_count'], disc_uni)
+    utils.write_section(outfile, utils.UNK_HEADER, {'<unk>':prob_unk})
+    utils.write_section(outfile, utils.UNI_HEADER, prob_unigrams)
+    progress(verbose, 'unigram')
+
+    ## lw bigrams, then backoff from large cluster to unigram
+    prob_lw = estimate_dimension(filename, large_label, word_label,
+                                 counts['large_clusters'], discount_method, discount,
+                                 cutoffs[2])
+    utils.write_bigram_section(outfile, utils.LW_HEADER, prob_lw)
+    backoff_l = utils.calc_backoff_uni(prob_lw, prob_unigrams)
+    progress(verbose, 'lw')
+
+    ## sw bigrams, then backoff from small to large cluster (lw no longer needed)
+    prob_sw = estimate_dimension(filename, small_label, word_label,
+                                 counts['small_clusters'], discount_method, discount,
+                                 cutoffs[1])
+    utils.write_bigram_section(outfile, utils.SW_HEADER, prob_sw)
+    backoff_sl = utils.calc_backoff_bi(counts['small_to_large'], prob_sw, prob_lw)
+    del prob_lw
+    progress(verbose, 'sw')
+
+    ## ww bigrams, one context at a time (sw no longer needed afterwards)
+    # a context's backoff from word to small cluster only needs its own ww row,
+    # so each row is written and dropped as soon as its weight is known
+    backoff_ws = estimate_ww(filename, word_label, outfile, unigrams,
+                             counts['word_to_small'], prob_sw, discount_method,
+                             discount, cutoffs[0])
+    del prob_sw
+    progress(verbose, 'ww')
+
+    ## backoff weights (small: one entry per word or cluster)
+    utils.write_section(outfile, utils.BACKOFF_L_HEADER, backoff_l)
+    utils.write_section(outfile, utils.BACKOFF_SL_HEADER, backoff_sl)
+    utils.write_section(outfile, utils.BACKOFF_WS_HEADER, backoff_ws)
+
+
+## counts one bigram dimension and turns it into probabilities
+# input: training file name, context label, word label, normalizer counts,
+#        discounting method, discount, count cutoff of the dimension
+# output: probability dict {context:{word2:log prob}} (counts already freed)
+def estimate_dimension(filename, context_label, word_label, normalizer,
+                       discount_method, discount, cutoff):
+    bigram_counts = utils.count_bigrams(filename, context_label, word_label)
+    disc = utils.get_discounts(utils.get_counts_bi(bigram_counts), discount_method, discount)
+    return utils.probs_bi_streaming(bigram_counts, normalizer, disc, cutoff)
+
+
+## counts the ww bigrams and writes their probabilities one context at a time
+# input: training file name, word label, open output file, unigram counts
+#        (normalizer), word to small cluster mapping, sw probability dict,
+#        discounting method, discount, count cutoff for ww
+# output: backoff weights from word to small cluster {word:log backoff}
+def estimate_ww(filename, word_label, outfile, unigrams, word_to_small, prob_sw,
+                discount_method, discount, cutoff):
+    bigram_counts = utils.count_bigrams(filename, word_label, word_label)
+    disc = utils.get_discounts(utils.get_counts_bi(bigram_counts), discount_method, discount)
+    outfile.write(utils.WW_HEADER + '\n')
+    backoff_ws = {}
+    for word1 in list(bigram_counts):
+        row = {word1:bigram_counts.pop(word1)}
+        prob_row = utils.probs_bi_streaming(row, unigrams, disc, cutoff)
+        utils.write_bigram_rows(outfile, prob_row)
+        backoff_ws.update(utils.calc_backoff_bi(word_to_small, prob_row, prob_sw))
+    return backoff_ws
+
+
+## writes a progress message with the peak memory so far
+# input: whether to write it, name of the dimension just finished
+# output: none
+def progress(verbose, dimension):
+    if not verbose:
+        return
+    message = 'Finished ' + dimension + ' probabilities'
+    peak = utils.get_peak_memory()
+    if peak is not None:
+        message += ' (peak memory so far: ' + str(int(peak)) + ' MB)'
+    sys.stderr.write(message + '\n')
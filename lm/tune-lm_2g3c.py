@@ -0,0 +1,176 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Tunes discounting and cutoffs of multidimensional backoff LMs (bigram with 3
+clusters) by held-out perplexity
+Usage: ./tune-lm_2g3c.py training_file heldout_file > results_file
+
+Training and held-out file format: same as the training file of create-lm_2g3c.py
+    - one sentence per line
+    - words separated by space
+    - words in the format W-word|S-small_cluster|L-large_cluster
+
+Output file format:
+    - results table (tab separated, best configuration first):
+      discount_method discount cutoff_ww cutoff_sw cutoff_lw perplexity
+    - then the create-lm_2g3c.py options for the best configuration
+
+The training data is only counted once. Each configuration is then estimated
+and scored in a pool of worker processes that share the read-only counts
+(inherited when the workers are forked, not pickled per configuration).
+
+Created on Mon Oct 19 16:20:47 2026
+"""
+
+## TO DO ##
+#  1. the model has no interpolation parameters yet; add them to the grid
+#     when it does
+#  2. simple search (e.g. coordinate descent) instead of the full grid
+
+from __future__ import division
+from itertools import product
+import argparse, multiprocessing, sys, model, utils
+
+__version__ = '1.0'
+
+# variables for word, small cluster, and large cluster labels
+# (same as in create-lm_2g3c.py)
+WORD_LABEL = 'W'
+SMALL_LABEL = 'S'
+LARGE_LABEL = 'L'
+
+# counts, counts of counts and held-out file shared by the workers (set by init_worker)
+shared_counts = None
+shared_counts_of_counts = None
+shared_heldout = None
+
+
+## main function
+def main():
+    ## parse command-line arguments
+    parser = get_parser()
+    args = vars(parser.parse_args())
+    # check the discounts before counting (and before the pool: exiting inside
+    # a worker would leave the pool waiting)
+    configs = get_configs(args)
+    if not configs:
+        sys.stderr.write('No configurations to evaluate: every combination of cutoffs ' +
+                         'increases from ww to sw to lw\n')
+        sys.exit(1)
+    for method, discount, cutoffs in configs:
+        utils.check_discount(method, discount)
+
+    ## count the training data once
+    counts = utils.count_ngrams(args['training_file'], WORD_LABEL, SMALL_LABEL, LARGE_LABEL)
+    # the same for every configuration (discounts are computed from them)
+    counts_of_counts = utils.get_counts_of_counts(counts)
+    sys.stderr.write('Finished getting ngram count dictionaries\n')
+
+    ## evaluate every configuration in parallel
+    sys.stderr.write('Evaluating ' + str(len(configs)) + ' configurations\n')
+    pool = multiprocessing.Pool(args['processes'], init_worker,
+                                (counts, counts_of_counts, args['heldout_file']))
+    results = pool.map(evaluate, configs)
+    pool.close()
+    pool.join()
+
+    ## write the results table, best configuration first
+    results.sort(key=lambda result: result[1])
+    sys.stdout.write('discount_method\tdiscount\tcutoff_ww\tcutoff_sw\tcutoff_lw\tperplexity\n')
+    for config, perplexity in results:
+        method, discount, cutoffs = config
+        sys.stdout.write(method + '\t' + str(discount) + '\t' +
+                         '\t'.join(str(cutoff) for cutoff in cutoffs) + '\t' +
+                         str(perplexity) + '\n')
+
+    # options for create-lm_2g3c.py
+    method, discount, cutoffs = results[0][0]
+    options = '--discount-method ' + method
+    if discount is not None:
+        options += ' --discount ' + str(discount)
+    options += ' --cutoffs ' + ' '.join(str(cutoff) for cutoff in cutoffs)
+    sys.stdout.write('\nbest: ' + options + '\n')
+    sys.stderr.write('Best perplexity ' + str(results[0][1]) + ' with ' + options + '\n')
+
+
+## stores the shared counts in a worker process
+# input: counts from utils.count_ngrams, counts of counts from
+#        utils.get_counts_of_counts, held-out file name
+# output: none (module variables set)
+def init_worker(counts, counts_of_counts, heldout_filename):
+    global shared_counts, shared_counts_of_counts, shared_heldout
+    shared_counts = counts
+    shared_counts_of_counts = counts_of_counts
+    shared_heldout = heldout_filename
+
+
+## estimates one configuration from the shared counts and scores it
+# input: (discount method, discount, (ww, sw, lw) cutoffs)
+# output: (configuration, held-out perplexity)
+def evaluate(config):
+    method, discount, cutoffs = config
+    tables = utils.estimate_lm(shared_counts, method, discount, cutoffs,
+                               counts_of_counts=shared_counts_of_counts)
+    return config, model.DictModel(tables).perplexity(shared_heldout)
+
+
+## gets the grid of configurations to evaluate
+# input: parsed command-line arguments
+# output: list of (discount method, discount, (ww, sw, lw) cutoffs)
+def get_configs(args):
+    # cutoffs must not increase from ww to sw to lw (see utils.check_cutoffs)
+    all_cutoffs = []
+    for cutoffs in product(args['cutoffs_ww'], args['cutoffs_sw'], args['cutoffs_lw']):
+        if cutoffs[1] <= cutoffs[0] and cutoffs[2] <= cutoffs[1]:
+            all_cutoffs.append(cutoffs)
+        else:
+            sys.stderr.write('Skipping cutoffs ' + ' '.join(str(cutoff) for cutoff in cutoffs) +
+                             ' (must not increase from ww to sw to lw)\n')
+
+    configs = []
+    for method in args['discount_methods']:
+        # only absolute discounting has a discount to tune
+        discounts = args['discounts'] if method == 'absolute' else [None]
+        for discount in discounts:
+            for cutoffs in all_cutoffs:
+                configs.append((method, discount, cutoffs))
+    return configs
+
+
+## parsing command-line arguments
+def get_parser():
+    parser = argparse.ArgumentParser()
+
+    # training data file (required argument)
+    parser.add_argument('training_file', help='file containing training data',
+                        metavar='training_file', type=str)
+    # held-out data file (required argument)
+    parser.add_argument('heldout_file', help='file containing held-out data',
+                        metavar='heldout_file', type=str)
+    # discounting methods to try (optional)
+    parser.add_argument('--discount-methods', help='discounting methods to try',
+                        dest='discount_methods', nargs='+', choices=utils.DISCOUNT_METHODS,
+                        default=utils.DISCOUNT_METHODS)
+    # discounts to try for absolute discounting (optional)
+    parser.add_argument('--discounts', help='discounts to try for absolute discounting',
+                        nargs='+', type=float, default=[0.5, 0.7, 0.9])
+    # count cutoffs to try for each dimension (optional)
+    parser.add_argument('--cutoffs-ww', help='ww bigram cutoffs to try', dest='cutoffs_ww',
+                        nargs='+', type=int, default=[0, 1, 2])
+    parser.add_argument('--cutoffs-sw', help='sw bigram cutoffs to try', dest='cutoffs_sw',
+                        nargs='+', type=int, default=[0, 1])
+    parser.add_argument('--cutoffs-lw', help='lw bigram cutoffs to try', dest='cutoffs_lw',
+                        nargs='+', type=int, default=[0])
+    # number of worker processes (optional)
+    parser.add_argument('-p', '--processes', help='number of worker processes (default: all cpus)',
+                        type=int, default=None)
+    # version info (optional)
+    parser.add_argument('-v', '--version', help='displays current version',
+                        action='version', version='%(prog)s '+__version__)
+
+    return parser
+
+
+## execute the code
+if __name__ == '__main__':
+    main()
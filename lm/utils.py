@@ -9,6 +9,47 @@ from __future__ import division
 import sys
 from math import log
 
+# peak memory can only be reported where the resource module exists (not Windows)
+try:
+    import resource
+except ImportError:
+    resource = None
+
+# discounting methods that can be used in estimate_lm
+DISCOUNT_METHODS = ['good-turing', 'absolute']
+
+# backoff weight used when the weight is undefined (see calc_backoff_weight)
+# note an int, so it is written as -1000 (code storing weights as floats must
+#      map it back, see parallel.decode_backoffs)
+BACKOFF_FALLBACK = -1000
+
+# section names of the model file (also used by model.py to read it)
+UNK_SECTION = 'unks'
+UNI_SECTION = '1-grams'
+BACKOFF_L_SECTION = 'backoff l to unigram'
+BACKOFF_SL_SECTION = 'backoff s to l'
+BACKOFF_WS_SECTION = 'backoff w to s'
+# prefix of the bigram sections ('2-grams ' + dimension)
+BIGRAM_PREFIX = '2-grams '
+
+
+## gets the header line of a model file section
+# input: section name
+# output: header (e.g. '\\1-grams:')
+def get_header(section):
+    return '\\' + section + ':'
+
+
+# section headers of the model file (in the order they are written)
+UNK_HEADER = get_header(UNK_SECTION)
+UNI_HEADER = get_header(UNI_SECTION)
+LW_HEADER = get_header(BIGRAM_PREFIX + 'lw')
+SW_HEADER = get_header(BIGRAM_PREFIX + 'sw')
+WW_HEADER = get_header(BIGRAM_PREFIX + 'ww')
+BACKOFF_L_HEADER = get_header(BACKOFF_L_SECTION)
+BACKOFF_SL_HEADER = get_header(BACKOFF_SL_SECTION)
+BACKOFF_WS_HEADER = get_header(BACKOFF_WS_SECTION)
+
 
 ## updates the counts in a bigram count dictionary
 # input: bigram and dictionary (format: {word1:{word2:count}})
@@ -61,6 +102,26 @@ def add_uni_counts(key, dictionary):
     return 0
 
 
+## removes bigrams with counts at or below a cutoff
+# input: bigram count dict, cutoff (0 keeps everything)
+# output: bigram count dict without the rare bigrams
+# note does not modify the input dict (counts may be shared between configurations)
+def apply_cutoff(bigram_counts, cutoff):
+    # nothing to remove
+    if cutoff <= 0:
+        return bigram_counts
+    # new dict with only the bigrams above the cutoff
+    kept_counts = {}
+    for word1 in bigram_counts:
+        kept = {}
+        for word2 in bigram_counts[word1]:
+            if bigram_counts[word1][word2] > cutoff:
+                kept[word2] = bigram_counts[word1][word2]
+        # keep the context even if all of its bigrams were removed (for backoff)
+        kept_counts[word1] = kept
+    return kept_counts
+
+
 ## calculates backoff weights for backing off to small or large cluster
 # input: mapping of the previous cluster to the current cluster (one backing off to)
 #        probability dictionary of the cluster backing off to
@@ -88,14 +149,7 @@ def calc_backoff_bi(p2c_mapping, prev_bigram_counts, curr_bigram_counts):
             # if the ww bigram appears, then sw appears so no need to consider lw, etc.
             curr_prob += 10 ** curr_bigram_counts[curr_cluster][word2]
             # now add to dict
-            # TO DO need to deal with when it is zero/undefined
-            try:
-                backoff_weights[prev_cluster] = log(1-prev_prob, 10) - log(1-curr_prob, 10)
-            except:
-                try:
-                    backoff_weights[prev_cluster] = log((1-prev_prob)/(1-curr_prob), 10)
-                except:
-                    backoff_weights[prev_cluster] = -1000
+            backoff_weights[prev_cluster] = calc_backoff_weight(prev_prob, curr_prob)
     
     return backoff_weights
 
@@ -121,18 +175,26 @@ def calc_backoff_uni(prev_dict, curr_dict):
             # add curr prob (for denominator) -- also NOT log prob
             curr_prob += 10 ** curr_dict[word2]
         # now add to dict
-        # TO DO need to deal with when it is zero/undefined
-        try:
-            backoff_weights[cluster] = log(1-prev_prob, 10) - log(1-curr_prob, 10)
-        except:
-            try:
-                backoff_weights[cluster] = log((1-prev_prob)/(1-curr_prob), 10)
-            except:
-                backoff_weights[cluster] = -1000
+        backoff_weights[cluster] = calc_backoff_weight(prev_prob, curr_prob)
     
     return backoff_weights
 
 
+## calculates one backoff weight from the probability mass of the seen bigrams
+# input: total prob of the bigrams in the dimension backing off, total prob of
+#        the same words in the dimension backed off to (both NOT log probs)
+# output: log backoff weight
+# TO DO need to deal with when it is zero/undefined
+def calc_backoff_weight(prev_prob, curr_prob):
+    try:
+        return log(1-prev_prob, 10) - log(1-curr_prob, 10)
+    except:
+        try:
+            return log((1-prev_prob)/(1-curr_prob), 10)
+        except:
+            return BACKOFF_FALLBACK
+
+
 ## calculates the discounting factor based on Good-Turing smoothing
 # input: ngram count dictionary
 # output: discounting factor for that count
@@ -154,6 +216,18 @@ def calc_discount(count_dict):
     return disc_dict
 
 
+## calculates the discounting factor for absolute discounting
+# input: ngram count dictionary, discount subtracted from each count (0 < discount < 1)
+# output: discounting factor for that count
+def calc_discount_absolute(count_dict, discount):
+    # dictionary for keeping the discounts
+    disc_dict = {}
+    # discount depends on count only: (count - D) / count
+    for count in count_dict:
+        disc_dict[count] = log(count - discount, 10) - log(count, 10)
+    return disc_dict
+
+
 ## calculates log maximum likelihood probability
 # input: count of bigrams, count of unigrams (prior)
 # output: log max likelihood
@@ -164,6 +238,203 @@ def calc_max_likely(num_count, denom_count):
     return numerator - denominator
 
 
+## checks that count cutoffs do not increase from ww to sw to lw
+# input: cutoffs for (ww, sw, lw) bigrams
+# output: none (exits if the cutoffs are not nested)
+def check_cutoffs(cutoffs):
+    if cutoffs[1] > cutoffs[0] or cutoffs[2] > cutoffs[1]:
+        sys.stderr.write('Cutoffs must not increase from ww to sw to lw: ' +
+                         ' '.join(str(cutoff) for cutoff in cutoffs) + '\n')
+        sys.exit(1)
+
+
+## checks that the discount for absolute discounting is between 0 and 1
+# input: discounting method, discount
+# output: none (exits if absolute discounting would give log of a count <= 0)
+def check_discount(discount_method, discount):
+    if discount_method == 'absolute' and (discount is None or not 0 < discount < 1):
+        sys.stderr.write('Discount for absolute discounting must be between 0 and 1: ' +
+                         str(discount) + '\n')
+        sys.exit(1)
+
+
+## gets the bigram counts of one dimension from a training file
+# input: training file name, label of the previous word's factor (context),
+#        label of the word
+# output: bigram count dict {context:{word2:count}}
+# note used to count one dimension at a time (see streaming.py)
+def count_bigrams(filename, context_label, word_label):
+    bigram_counts = {}
+    with open(filename, 'r') as training_file:
+        # read through line by line (one sentence per line)
+        for line in training_file:
+            line_words = line.strip().split(' ')
+            # pair each word with the previous word's factor
+            for index in range(1, len(line_words)):
+                add_bi_counts(get_part(line_words[index-1], context_label),
+                              get_part(line_words[index], word_label), bigram_counts)
+    return bigram_counts
+
+
+## gets the unigram and bigram counts (and factor mappings) from a training file
+# input: training file name, labels of the word, small cluster and large cluster,
+#        whether to count bigrams (if not, the bigram dicts are left empty)
+# output: dictionary of counts and mappings
+#         {'unigrams', 'small_clusters', 'large_clusters': {word:count}
+#          'bigrams_ww', 'bigrams_sw', 'bigrams_lw': {word1:{word2:count}}
+#          'word_to_small', 'small_to_large': {word:cluster}
+#          'total_word_count': number of tokens}
+def count_ngrams(filename, word_label, small_label, large_label, bigrams=True):
+    # dictionaries to store the counts
+    unigrams = {}
+    small_clusters = {}
+    large_clusters = {}
+    bigrams_ww = {}
+    bigrams_sw = {}
+    bigrams_lw = {}
+    
+    # also get word factor mappings
+    # convert from word to small cluster and small cluster to large cluster
+    word_to_small = {}
+    small_to_large = {}
+    
+    # will need total word count for unigram probs
+    total_word_count = 0
+    
+    with open(filename, 'r') as training_file:
+        # read through line by line (one sentence per line)
+        for line in training_file:
+            # split the line into words (with clusters still attached)
+            line_words = line.strip().split(' ')
+            
+            ## loop through the words in the sentence
+            for index, word in enumerate(line_words):
+                # increment total word count
+                total_word_count += 1
+                
+                # get the word and its parts
+                word2 = get_part(word, word_label)
+                small2 = get_part(word, small_label)
+                large2 = get_part(word, large_label)
+                
+                # add to mappings of words and factors
+                add_to_dict(word2, small2, word_to_small)
+                add_to_dict(small2, large2, small_to_large)
+                
+                # add to unigram count dictionaries
+                add_uni_counts(word2, unigrams)
+                add_uni_counts(small2, small_clusters)
+                add_uni_counts(large2, large_clusters)
+                
+                # if it is the second or later word, get prev word cluster
+                # for first word, just consider unigrams (TO DO should be bigram with <s> first??)
+                if index > 0 and bigrams:
+                    word1 = get_part(line_words[index-1], word_label)
+                    small1 = get_part(line_words[index-1], small_label)
+                    large1 = get_part(line_words[index-1], large_label)
+                    
+                    # add to bigram dictionaries
+                    add_bi_counts(word1, word2, bigrams_ww)
+                    add_bi_counts(small1, word2, bigrams_sw)
+                    add_bi_counts(large1, word2, bigrams_lw)
+    
+    return {'unigrams':unigrams, 'small_clusters':small_clusters,
+            'large_clusters':large_clusters, 'bigrams_ww':bigrams_ww,
+            'bigrams_sw':bigrams_sw, 'bigrams_lw':bigrams_lw,
+            'word_to_small':word_to_small, 'small_to_large':small_to_large,
+            'total_word_count':total_word_count}
+
+
+## gets the counts of counts of the unigrams and of each bigram dimension
+# input: counts from count_ngrams
+# output: {'uni', 'ww', 'sw', 'lw': {count:number of ngrams with that count}}
+# note they do not depend on the discounting or cutoffs, so they can be
+#      computed once and shared when estimating several models (see tune-lm_2g3c.py)
+def get_counts_of_counts(counts):
+    return {'uni':get_counts_uni(counts['unigrams']),
+            'ww':get_counts_bi(counts['bigrams_ww']),
+            'sw':get_counts_bi(counts['bigrams_sw']),
+            'lw':get_counts_bi(counts['bigrams_lw'])}
+
+
+## calculates probabilities and backoff weights from the ngram counts
+# input: counts from count_ngrams, discounting method (see DISCOUNT_METHODS),
+#        discount for absolute discounting, count cutoffs for (ww, sw, lw) bigrams,
+#        whether to write progress messages to stderr,
+#        counts of counts from get_counts_of_counts (computed here if None)
+# output: dictionary of model tables
+#         {'prob_unk': unk log prob, 'prob_unigrams': {word:log prob},
+#          'prob_ww', 'prob_sw', 'prob_lw': {word1:{word2:log prob}},
+#          'backoff_ws', 'backoff_sl', 'backoff_l': {word/cluster:log backoff}}
+# note cutoffs must not increase from ww to sw to lw, otherwise a ww bigram
+#      could be kept while its sw bigram is removed (and backoffs break)
+def estimate_lm(counts, discount_method='good-turing', discount=None,
+                cutoffs=(0, 0, 0), verbose=False, counts_of_counts=None):
+    unigrams = counts['unigrams']
+    
+    # cutoffs must be nested (see note above)
+    check_cutoffs(cutoffs)
+    
+    ## get counts of counts for use in discounting
+    # note discounts use all counts, before any cutoffs
+    if counts_of_counts is None:
+        counts_of_counts = get_counts_of_counts(counts)
+    count_unigrams = counts_of_counts['uni']
+    count_ww = counts_of_counts['ww']
+    count_sw = counts_of_counts['sw']
+    count_lw = counts_of_counts['lw']
+
+    # will need vocab size for unk probs
+    vocab_size = len(unigrams)
+    if verbose:
+        sys.stderr.write('Finished getting counts of counts\n')    
+    
+    ## get discounts (depend on the counts, not on the ngram itself)
+    disc_uni = get_discounts(count_unigrams, discount_method, discount)
+    disc_ww = get_discounts(count_ww, discount_method, discount)
+    disc_sw = get_discounts(count_sw, discount_method, discount)
+    disc_lw = get_discounts(count_lw, discount_method, discount)
+    
+    ## remove rare bigrams (their mass goes to the backoff)
+    bigrams_ww = apply_cutoff(counts['bigrams_ww'], cutoffs[0])
+    bigrams_sw = apply_cutoff(counts['bigrams_sw'], cutoffs[1])
+    bigrams_lw = apply_cutoff(counts['bigrams_lw'], cutoffs[2])
+    
+    ## calculate log probability of each unigram and bigram
+    prob_unigrams = probs_uni(unigrams, counts['total_word_count'], disc_uni)
+    prob_ww = probs_bi(bigrams_ww, unigrams, disc_ww)
+    prob_sw = probs_bi(bigrams_sw, counts['small_clusters'], disc_sw)
+    prob_lw = probs_bi(bigrams_lw, counts['large_clusters'], disc_lw)
+    # unknowns (GT estimate): count(words appearing once) / |V|
+    prob_unk = log(count_unigrams[1], 10) - log(vocab_size, 10)
+
+    if verbose:
+        sys.stderr.write('Finished getting probability dictionaries\n')    
+
+    ## calculate backoff (alpha) of each backoff step
+    # backoff from word to small cluster
+    backoff_ws = calc_backoff_bi(counts['word_to_small'], prob_ww, prob_sw)
+    if verbose:
+        sys.stderr.write('Finished getting w2s backoff dictionary\n')   
+    
+    # backoff from small cluster to large cluster
+    backoff_sl = calc_backoff_bi(counts['small_to_large'], prob_sw, prob_lw)
+    ## TO DO some of these (and w2s) are > 1 which shouldn't happen!
+    if verbose:
+        sys.stderr.write('Finished getting s2l backoff dictionary\n')  
+    
+    # backoff from large cluster to unigram (ignore previous word altogether)
+    backoff_l = calc_backoff_uni(prob_lw, prob_unigrams)
+    #### TO DO Something is wrong here because almost all are -1000!
+    if verbose:
+        sys.stderr.write('Finished getting l2u backoff dictionary\n')   
+        sys.stderr.write('Finished getting backoff factor dictionaries\n')    
+    
+    return {'prob_unk':prob_unk, 'prob_unigrams':prob_unigrams,
+            'prob_ww':prob_ww, 'prob_sw':prob_sw, 'prob_lw':prob_lw,
+            'backoff_ws':backoff_ws, 'backoff_sl':backoff_sl, 'backoff_l':backoff_l}
+
+
 ## reads in factor file and stores in a dictionary
 # input: name of the factor file 
 #        format: word factor\n (or factor1 factor\n for factor-factor matchings)
@@ -229,6 +500,21 @@ def get_counts_uni(unigram_dict):
     return count_dict
 
 
+## calculates the discounting factors for a discounting method
+# input: count of counts dictionary, discounting method (see DISCOUNT_METHODS),
+#        discount (only used for absolute discounting)
+# output: discounting factor for each count
+def get_discounts(count_dict, discount_method, discount=None):
+    if discount_method == 'good-turing':
+        return calc_discount(count_dict)
+    elif discount_method == 'absolute':
+        check_discount(discount_method, discount)
+        return calc_discount_absolute(count_dict, discount)
+    else:
+        sys.stderr.write('Unknown discounting method: ' + discount_method + '\n')
+        sys.exit(1)
+
+
 ## breaks a word-cluster trio into parts (word or cluster)
 # input: word in format W-word|S-short|L-large, desired part label
 # output: relevant part of the word (word, small cluster, or large cluster)
@@ -246,6 +532,22 @@ def get_part(word, part_label):
     return word[part_start + 2:part_start + part_end]
 
 
+## gets the peak memory (resident set size) of this process so far
+# input: whether to get it for the finished child processes instead
+#        (e.g. pool workers, once they have been joined)
+# output: peak memory in MB (None if it can't be measured here)
+# note for children this is the peak of the largest child, not their sum
+def get_peak_memory(children=False):
+    if resource is None:
+        return None
+    who = resource.RUSAGE_CHILDREN if children else resource.RUSAGE_SELF
+    peak = resource.getrusage(who).ru_maxrss
+    # kilobytes on Linux, bytes on Mac OS
+    if sys.platform == 'darwin':
+        return peak / (1024 * 1024)
+    return peak / 1024
+
+
 ## calculates bigram probabilities from a bigram count dictionary
 # input: bigram count dict, unigram count dict (for normalization), discount dict
 # output: probability dict {word1:{word2:probability}}
@@ -270,6 +572,37 @@ def probs_bi(bigram_counts, normalizer, disc_dict):
     return prob_dict
 
 
+## calculates bigram probabilities, emptying the bigram count dict as it goes
+# input: bigram count dict (emptied), unigram count dict (for normalization),
+#        discount dict, count cutoff (see apply_cutoff)
+# output: probability dict {word1:{word2:probability}} (same as probs_bi)
+# note each context's counts are freed as soon as its probs are made, so the
+#      counts and probs of a dimension are never both fully in memory
+def probs_bi_streaming(bigram_counts, normalizer, disc_dict, cutoff=0):
+    # drop the rare bigrams first (like apply_cutoff, but moving the rows)
+    if cutoff > 0:
+        kept_counts = {}
+        for word1 in list(bigram_counts):
+            row = bigram_counts.pop(word1)
+            kept = {}
+            for word2 in row:
+                if row[word2] > cutoff:
+                    kept[word2] = row[word2]
+            kept_counts[word1] = kept
+        bigram_counts = kept_counts
+    # dictionary to store bigram probs {word1:{word2:prob}}
+    prob_dict = {}
+    # same order as probs_bi, but removing each row once it is converted
+    for word1 in list(bigram_counts):
+        row = bigram_counts.pop(word1)
+        prob_dict[word1] = {}
+        for word2 in row:
+            # prob = d*max likely (log disc + log max likelihood)
+            prob_dict[word1][word2] = disc_dict[row[word2]] + \
+                calc_max_likely(row[word2], normalizer[word1])
+    return prob_dict
+
+
 ## calculats unigram probabilities from a unigram count dictionary
 # input: unigram count dict, vocab size (for normalization), discount dict
 # output: probability dict ({word:prob})
@@ -287,3 +620,30 @@ def probs_uni(unigram_counts, word_count, disc_dict):
     
     # once we've gone through al unigrams, we are done
     return prob_dict
+
+
+## writes a bigram probability section of the model file
+# input: open output file, section header (e.g. '\\2-grams ww:'),
+#        probability dict {word1:{word2:prob}}
+# output: none (section written)
+def write_bigram_section(outfile, header, prob_dict):
+    outfile.write(header + '\n')
+    write_bigram_rows(outfile, prob_dict)
+
+
+## writes bigram probability rows (no section header)
+# input: open output file, probability dict {word1:{word2:prob}}
+# output: none (rows written)
+def write_bigram_rows(outfile, prob_dict):
+    for word1 in prob_dict:
+        for word2 in prob_dict[word1]:
+            outfile.write(str(prob_dict[word1][word2]) + '\t' + word1 + ' ' + word2 + '\n')
+
+
+## writes a unigram probability or backoff section of the model file
+# input: open output file, section header (e.g. '\\1-grams:'), dict {key:value}
+# output: none (section written)
+def write_section(outfile, header, table):
+    outfile.write(header + '\n')
+    for key in table:
+        outfile.write(str(table[key]) + '\t' + key + '\n')